@@ -0,0 +1,158 @@
+"""
+benchmark.py
+
+Offline timing and accuracy of the detection paths on synthetic masks.
+No camera needed. Run: python benchmark.py [frames]
+"""
+
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from config import SLIDER_CONFIG, CAMERA_WIDTH, CAMERA_HEIGHT
+from detection import detect_shape, pyramid_factor
+
+Truth = Tuple[float, float]  # object center (cx, cy)
+
+# Scenes: (circles, squares, noise specks)
+SCENES: Dict[str, Tuple[int, int, int]] = {
+    "empty": (0, 0, 0),
+    "specks": (0, 0, 400),
+    "2 balls": (2, 0, 50),
+    "6 balls": (6, 0, 50),
+    "2 squares": (0, 2, 50),
+}
+
+
+def default_params() -> dict:
+    return {name: cfg["default"] for name, cfg in SLIDER_CONFIG.items()}
+
+
+def synthetic_mask(rng: np.random.Generator, n_circles: int, n_squares: int, n_specks: int,
+                   w: int = CAMERA_WIDTH, h: int = CAMERA_HEIGHT) -> Tuple[np.ndarray, List[Truth], List[Truth]]:
+    """
+    Binary mask with non-overlapping balls/squares plus single-pixel noise. Returns mask and true centers.
+    """
+    mask = np.zeros((h, w), dtype=np.uint8)
+    circles: List[Truth] = []
+    squares: List[Truth] = []
+    taken: List[Tuple[float, float, float]] = []
+
+    def place(size: float) -> Tuple[float, float]:
+        for _ in range(100):
+            cx, cy = rng.uniform(size, w - size), rng.uniform(size, h - size)
+            if all((cx - x) ** 2 + (cy - y) ** 2 > (size + s + 10) ** 2 for x, y, s in taken):
+                taken.append((cx, cy, size))
+                return cx, cy
+        return -1.0, -1.0
+
+    for _ in range(n_circles):
+        r = rng.uniform(55, 75)
+        cx, cy = place(r)
+        if cx < 0:
+            continue
+        cv2.circle(mask, (int(round(cx)), int(round(cy))), int(round(r)), 255, -1)
+        circles.append((round(cx), round(cy)))
+    for _ in range(n_squares):
+        side = rng.uniform(90, 130)
+        cx, cy = place(side * 0.75)
+        if cx < 0:
+            continue
+        box = cv2.boxPoints(((cx, cy), (side, side), rng.uniform(0, 90))).astype(np.int32)
+        cv2.fillPoly(mask, [box], 255)
+        squares.append((cx, cy))
+    ys, xs = rng.integers(0, h, n_specks), rng.integers(0, w, n_specks)
+    mask[ys, xs] = 255
+    return mask, circles, squares
+
+
+def time_path(fn: Callable[[np.ndarray], List[dict]], masks: List[np.ndarray]) -> Tuple[float, List[List[dict]]]:
+    """
+    Mean milliseconds per mask and the detections for each mask.
+    """
+    fn(masks[0])
+    out = []
+    t0 = time.perf_counter()
+    for m in masks:
+        out.append(fn(m))
+    return (time.perf_counter() - t0) * 1000.0 / len(masks), out
+
+
+def accuracy(dets: List[List[dict]], truths: List[List[Truth]], max_err: float = 20.0) -> Tuple[float, float, int]:
+    """
+    Recall, mean center error (px) of matched objects, and false positives.
+    """
+    hits, total, fp, errs = 0, 0, 0, []
+    for frame_dets, frame_truth in zip(dets, truths):
+        total += len(frame_truth)
+        used = set()
+        for tx, ty in frame_truth:
+            best, best_i = max_err, -1
+            for i, d in enumerate(frame_dets):
+                e = float(np.hypot(d["cx"] - tx, d["cy"] - ty))
+                if i not in used and e <= best:
+                    best, best_i = e, i
+            if best_i >= 0:
+                used.add(best_i)
+                hits += 1
+                errs.append(best)
+        fp += len(frame_dets) - len(used)
+    return (hits / total if total else 1.0), (float(np.mean(errs)) if errs else 0.0), fp
+
+
+def report(title: str, rows: List[Tuple[str, str, float, Tuple[float, float, int]]]) -> None:
+    print(f"\n{title}")
+    print(f"{'scene':<12}{'path':<12}{'ms/frame':>10}{'recall':>9}{'err px':>9}{'FP':>6}")
+    for scene, path, ms, (rec, err, fp) in rows:
+        print(f"{scene:<12}{path:<12}{ms:>10.2f}{rec:>9.2f}{err:>9.2f}{fp:>6}")
+
+
+def bench_blob_prefilter(frames: int, params: dict) -> None:
+    """
+    Full-frame detection vs. connected-component prefilter, per detector.
+    """
+    rng = np.random.default_rng(0)
+    for shape in ("circle", "square"):
+        rows = []
+        for scene, (nc, ns, specks) in SCENES.items():
+            data = [synthetic_mask(rng, nc, ns, specks) for _ in range(frames)]
+            masks = [m for m, _, _ in data]
+            truths = [c if shape == "circle" else s for _, c, s in data]
+            for path, pre in (("full", False), ("prefilter", True)):
+                ms, dets = time_path(lambda m: detect_shape(m, shape, params, prefilter=pre), masks)
+                rows.append((scene, path, ms, accuracy(dets, truths)))
+        report(f"Blob prefilter – {shape}", rows)
+
+
+def bench_pyramid(frames: int, params: dict) -> None:
+    """
+    Accuracy vs. speed of coarse-to-fine pyramid detection against full resolution.
+    """
+    rng = np.random.default_rng(1)
+    scenes = {"2 balls": (2, 0, 50), "6 balls": (6, 0, 50), "2 squares": (0, 2, 50), "4 squares": (0, 4, 50)}
+    for shape in ("circle", "square", "rectangle"):
+        rows = []
+        for scene, (nc, ns, specks) in scenes.items():
+            if (shape == "circle") != (nc > 0):
+                continue
+            data = [synthetic_mask(rng, nc, ns, specks) for _ in range(frames)]
+            masks = [m for m, _, _ in data]
+            truths = [c if shape == "circle" else s for _, c, s in data]
+            for path, pyr in (("full", False), ("pyramid", True)):
+                ms, dets = time_path(lambda m: detect_shape(m, shape, params, pyramid=pyr), masks)
+                rows.append((scene, path, ms, accuracy(dets, truths)))
+        report(f"Pyramid (factor {pyramid_factor(params)}) – {shape}", rows)
+
+
+def main() -> None:
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    params = default_params()
+    bench_blob_prefilter(frames, params)
+    bench_pyramid(frames, params)
+
+
+if __name__ == "__main__":
+    main()
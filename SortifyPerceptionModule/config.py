@@ -4,7 +4,7 @@ config.py
 Global parameters and all system settings for detection, tracking, color, and GUI.
 """
 
-from typing import Dict, Tuple, Any
+from typing import Dict, List, Tuple, Any
 import logging
 
 # Mode, enabling GUI, sliders, YOLO + other settings
@@ -12,10 +12,22 @@ MODE = "demo"        # safety - sortify - demo
 USE_GUI: bool = True
 USE_TRACKBARS: bool = True
 ENABLE_YOLO: bool = True
+YOLO_ASYNC: bool = True         # run YOLO on a background worker instead of inside the frame loop
+YOLO_MAX_LAG_FRAMES: int = 5    # YOLO results older than this are ignored
 DRAW_DETECTIONS = True
 DRAW_SCORING = False
 DEBUG_LAYOUT = "2x1"  # "2x1" or "2x2"
 
+# Threaded pipeline: capture → detect → YOLO → track → render on separate threads
+PIPELINE_MODE: bool = False
+PIPELINE_QUEUE_SIZE: int = 2
+PIPELINE_DROP_OLDEST: bool = True     # False → block the producer when a queue is full (always for video files)
+
+# Per-stage time budgets (ms) checked by the deadline watchdog; overruns are logged and counted
+STAGE_DEADLINES_MS: Dict[str, float] = {
+    "track": 50.0,
+}
+
 
 
 # Which shapes/colors are tracked in this system
@@ -30,6 +42,55 @@ TRACK_TARGETS = [
 
 ]
 
+# Connected-component prefilter per detector: skip masks without a blob above the
+# detector's min area and run shape detection only inside padded blob ROIs
+BLOB_PREFILTER: Dict[str, bool] = {"circle": False, "square": False, "rectangle": False}
+BLOB_ROI_PAD: int = 12
+
+# Coarse-to-fine pyramid per detector: find candidates on a mask downscaled by a
+# power of two chosen from minRadius, then refine each in a full-resolution window
+PYRAMID_MODE: Dict[str, bool] = {"circle": False, "square": False, "rectangle": False}
+PYRAMID_MIN_RADIUS_PX: int = 12       # smallest object radius allowed on the coarse level
+
+# Tracker-guided detection: between full-frame rescans, detect only in windows
+# around each track's Kalman-predicted position (sized by its covariance).
+# With PIPELINE_MODE the detect stage waits for the previous frame's tracks,
+# so results match the sequential loop
+TRACKER_GUIDED_DETECTION: bool = False
+GUIDED_RESCAN_INTERVAL: int = 15      # frames between full-frame scans
+GUIDED_SIGMA: float = 3.0             # window = 1.5 * radius + GUIDED_SIGMA * position std + margin
+GUIDED_MARGIN_PX: int = 16
+
+# Frames in a row a track may be matched to a same-shape detection of another color
+# (e.g. a ball misread under glare) before it is treated as lost; 0 = colors never mix
+TRACK_COLOR_GRACE_FRAMES: int = 3
+
+# The tracker steps its Kalman filters by the real time between frames (in frame periods),
+# so dropped or skipped frames are coasted over; a single step is capped at this many frames
+TRACK_MAX_DT_FRAMES: float = 10.0
+
+# Tracker checkpoint for warm restarts: tracks, candidates, Kalman states and the ID counter
+# are written here every interval (atomically), and restored on start when younger than the
+# max age, coasted over the downtime; "" disables
+TRACK_CHECKPOINT_PATH: str = "tracker_checkpoint.npz"
+TRACK_CHECKPOINT_INTERVAL_S: float = 2.0
+TRACK_CHECKPOINT_MAX_AGE_S: float = 10.0
+
+# Workspace ROIs in full-frame pixels, applied right after capture. Each entry is a
+# rectangle (x0, y0, x1, y1) or a polygon [(x, y), ...]; pixels outside all of them
+# are never processed. Empty → whole frame.
+WORKSPACE_ROIS: List[Any] = []
+
+# Motion gating: diff a downsampled frame per tile against the last processed
+# content; static frames reuse the previous detections, changed tiles are re-detected
+MOTION_GATING: bool = False
+MOTION_TILE_PX: int = 80              # tile size in full-resolution pixels
+MOTION_DOWNSCALE: int = 8             # frame is diffed at 1/MOTION_DOWNSCALE resolution
+MOTION_PIXEL_THRESH: int = 12         # per-channel change counting a downscaled pixel as changed
+MOTION_TILE_MIN_PIXELS: int = 2       # changed pixels needed to mark a tile as changed
+MOTION_ROI_PAD: int = 80              # detection windows extend this far past changed tiles
+MOTION_REFRESH_INTERVAL: int = 30     # frames between forced full-frame passes
+
 # BGR color codes for overlays and drawing
 COLOR_BGR: Dict[str, Tuple[int, int, int]] = {
     "red": (0, 0, 255),
@@ -43,7 +104,7 @@ COLOR_BGR: Dict[str, Tuple[int, int, int]] = {
 TILT_DEGREES = 0
 CAMERA_LEFT_MM = 0
 CAMERA_ABOVE_BASE_MM  = 0
-CAMERA_FORAWRD_MM = 0
+CAMERA_FORWARD_MM = 0
 
 # Depth and position estimation
 MASK_OVERLAP_OK: float = 0.65
@@ -51,6 +112,8 @@ Z_CORRECTION_BY_ROW = {"top": 0.0, "middle": 0.0, "bottom": 0.0}
 DEPTH_MIN_MM: int = 500
 DEPTH_MAX_MM: int = 1000
 DEPTH_OFFSET_MM = 0
+DEPTH_MAD_K: float = 3.0          # depth inliers lie within K · 1.4826 · MAD of the median (≈ K sigma)
+DEPTH_MIN_INLIERS: int = 15       # fewer inliers → no position
 
 # DEPTHAI camera settings
 CAMERA_WIDTH: int = 640
@@ -171,6 +234,7 @@ SLIDER_CONFIG: Dict[str, Dict[str, Any]] = {
     "match_dist": {"default": 1500, "max": 5000, "group": "tracking"},
     "max_lost": {"default": 30, "max": 30, "group": "tracking"},
     "spawn_persist": {"default": 0, "max": 30, "group": "tracking"},
+    "cand_ttl": {"default": 10, "max": 60, "group": "tracking"},
     "speed_gain": {"default": 0, "max": 30, "group": "tracking"},
     "stable_age": {"default": 0, "max": 30, "group": "tracking"},
     "kf_q_2d": {"default": 2, "max": 50, "group": "kalman"},
@@ -203,7 +267,7 @@ GROUND_TRUTH_POS: Dict[Tuple[str, str], Tuple[float, float, float]] = {
 LOG_COLUMNS = [
     "test_type", "frame", "time_sec", "fps", "track_id", "shape", "color",
     "x_mm", "y_mm", "z_mm", "pos_error_mm", "depth_valid", "depth_mask_valid",
-    "color_valid", "shape_valid"
+    "depth_inliers", "color_valid", "shape_valid"
 ]
 LOGGING_MAX_FRAMES_DEFAULT: int = 1000
 LOGGING_TOGGLE_KEY: int = ord("l")
@@ -6,7 +6,7 @@ Handles per-object drawing and builds debug window.
 """
 
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import cv2
 import numpy as np
 from config import COLOR_BGR
@@ -91,21 +91,28 @@ def build_debug_view(
     red_mask: np.ndarray,
     blue_mask: np.ndarray,
     overlay: np.ndarray,
+    out: Optional[np.ndarray] = None,
 ) -> np.ndarray:
-
+    """
+    Panes are written straight into *out* (2h × 2w × 3), allocated if not given.
+    """
     h, w = preproc.shape[:2]
+    if out is None:
+        out = np.empty((2 * h, 2 * w, 3), dtype=np.uint8)
 
     # Make sure image is BGR and correct size
-    def to_bgr(img: np.ndarray) -> np.ndarray:
-        if img.ndim == 2:                            
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        return cv2.resize(img, (w, h))
-
-    pane0   = to_bgr(preproc)
-    red_bgr = to_bgr(red_mask)
-    blue_bgr= to_bgr(blue_mask)
-    overlay = to_bgr(overlay)
-
-    top    = np.hstack((pane0,   red_bgr))
-    bottom = np.hstack((blue_bgr, overlay))
-    return np.vstack((top, bottom))
+    def to_bgr(img: np.ndarray, dst: np.ndarray) -> None:
+        if img.shape[:2] != (h, w):
+            if img.ndim == 2:
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            dst[:] = cv2.resize(img, (w, h))
+        elif img.ndim == 2:
+            cv2.cvtColor(img, cv2.COLOR_GRAY2BGR, dst=dst)
+        else:
+            np.copyto(dst, img)
+
+    to_bgr(preproc, out[:h, :w])
+    to_bgr(red_mask, out[:h, w:])
+    to_bgr(blue_mask, out[h:, :w])
+    to_bgr(overlay, out[h:, w:])
+    return out
@@ -7,12 +7,13 @@ Raw 2D detection logic only.
 
 import cv2
 import numpy as np
-from typing import Protocol, Dict, Any, List
-from config import TRACK_TARGETS
-from preprocessing import clean_mask as morph
-from preprocessing import apply_gaussian_blur
+from typing import Protocol, Dict, Any, List, Optional, Sequence, Tuple
+from config import TRACK_TARGETS, BLOB_PREFILTER, BLOB_ROI_PAD, PYRAMID_MODE, PYRAMID_MIN_RADIUS_PX
+from preprocessing import apply_gaussian_blur, PreprocessPipeline
 from position_estimation import mask_overlap as circle_mask_overlap
 
+Roi = Tuple[int, int, int, int]  # x0, y0, x1, y1 (exclusive)
+
 
 class Detector(Protocol):
     """
@@ -38,6 +39,21 @@ class CircleDetector:
     """
     Detect circles in a given mask using HoughCircles.
     """    
+    def __init__(self) -> None:
+        self._scratch: Dict[str, np.ndarray] = {}
+
+    def scratch(self, name: str, h: int, w: int) -> np.ndarray:
+        """
+        Zeroed (h, w) view into a reusable buffer that only grows.
+        """
+        buf = self._scratch.get(name)
+        if buf is None or buf.shape[0] < h or buf.shape[1] < w:
+            bh, bw = (h, w) if buf is None else (max(h, buf.shape[0]), max(w, buf.shape[1]))
+            buf = self._scratch[name] = np.zeros((bh, bw), dtype=np.uint8)
+        view = buf[:h, :w]
+        view.fill(0)
+        return view
+
     def detect(self, mask: np.ndarray, params: dict) -> List[Dict[str, Any]]:
         dp = float(params["dp"]) / 10.0
         minDist = int(params["minDist"])
@@ -77,16 +93,19 @@ class CircleDetector:
             if mask[cy, cx] == 0:
                 continue
 
-            patch = mask[
-                max(0, cy - r) : min(cy + r + 1, img_h),
-                max(0, cx - r) : min(cx + r + 1, img_w),
-            ]
+            # Verify on the candidate's bounding patch only
+            x0, y0 = max(0, cx - r), max(0, cy - r)
+            x1, y1 = min(cx + r + 1, img_w), min(cy + r + 1, img_h)
+            patch = mask[y0:y1, x0:x1]
             if cv2.countNonZero(patch) < int(params.get("c_area", 500)):
                 continue
 
-            circle_mask = np.zeros_like(mask)
-            cv2.circle(circle_mask, (cx, cy), r, 255, -1)
-            masked_blob = cv2.bitwise_and(mask, mask, mask=circle_mask)
+            ph, pw = y1 - y0, x1 - x0
+            circle_mask = self.scratch("circle", ph, pw)
+            cv2.circle(circle_mask, (int(cx - x0), int(cy - y0)), int(r), 255, -1)
+            # 1 px zero border so contours never touch the buffer edge
+            masked_blob = self.scratch("blob", ph + 2, pw + 2)
+            cv2.bitwise_and(patch, patch, dst=masked_blob[1:-1, 1:-1], mask=circle_mask)
             contours, _ = cv2.findContours(
                 masked_blob, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
             )
@@ -125,54 +144,134 @@ class CircleDetector:
         return raw
 
 
+class ContourFeatures:
+    """
+    Per-contour features of one mask as NumPy arrays, computed cheapest first.
+    Area and bounding extent come from one batched pass over all points; the
+    OpenCV calls (arcLength, approxPolyDP, convexHull, minAreaRect) only run on
+    contours still selected. Feature getters return arrays aligned with `index`.
+    """
+    def __init__(self, contours: Sequence[np.ndarray]) -> None:
+        self.contours = contours
+        n = len(contours)
+        self.index = np.arange(n)
+        self._area = np.zeros(n)
+        self._box_area = np.zeros(n)
+        self._perimeter = np.full(n, np.nan)
+        self._hull_area = np.full(n, np.nan)
+        self._rect = np.full((n, 5), np.nan)   # cx, cy, w, h, angle with w >= h
+        if n == 0:
+            return
+
+        lens = np.fromiter((len(c) for c in contours), dtype=np.intp, count=n)
+        starts = np.zeros(n, dtype=np.intp)
+        np.cumsum(lens[:-1], out=starts[1:])
+        pts = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+        x, y = pts[:, 0], pts[:, 1]
+
+        # Shoelace area (exact for integer points, same as cv2.contourArea)
+        nxt = np.arange(1, len(pts) + 1)
+        nxt[starts + lens - 1] = starts
+        cross = x * y[nxt] - x[nxt] * y
+        self._area = np.abs(np.add.reduceat(cross, starts)) * 0.5
+
+        # Axis-aligned extent: an upper bound for the area of any polygon on these points
+        w = np.maximum.reduceat(x, starts) - np.minimum.reduceat(x, starts)
+        h = np.maximum.reduceat(y, starts) - np.minimum.reduceat(y, starts)
+        self._box_area = w * h
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def select(self, keep: np.ndarray) -> None:
+        """
+        Narrow the selection to entries where *keep* (aligned with `index`) holds.
+        """
+        self.index = self.index[keep]
+
+    def area(self) -> np.ndarray:
+        return self._area[self.index]
+
+    def box_area(self) -> np.ndarray:
+        return self._box_area[self.index]
+
+    def perimeter(self) -> np.ndarray:
+        for i in self.index[np.isnan(self._perimeter[self.index])]:
+            self._perimeter[i] = cv2.arcLength(self.contours[i], True)
+        return self._perimeter[self.index]
+
+    def hull_area(self) -> np.ndarray:
+        for i in self.index[np.isnan(self._hull_area[self.index])]:
+            self._hull_area[i] = cv2.contourArea(cv2.convexHull(self.contours[i]))
+        return self._hull_area[self.index]
+
+    def min_area_rect(self) -> Tuple[np.ndarray, ...]:
+        """
+        cx, cy, w, h, angle of the selected contours, with w >= h and angle in [0, 180).
+        """
+        for i in self.index[np.isnan(self._rect[self.index, 0])]:
+            (cx, cy), (w, h), angle = cv2.minAreaRect(self.contours[i])
+            if w < h:
+                w, h = h, w
+                angle += 90.0
+            self._rect[i] = (cx, cy, w, h, angle % 180.0)
+        return tuple(self._rect[self.index].T)
+
+    def polygons(self, eps_scale: float, vertices: int = 4) -> List[np.ndarray]:
+        """
+        approxPolyDP of the selected contours (epsilon relative to perimeter).
+        Keeps only contours whose polygon has *vertices* corners and returns those polygons.
+        """
+        peri = self.perimeter()
+        approx = [
+            cv2.approxPolyDP(self.contours[i], eps_scale * pl, True)
+            for i, pl in zip(self.index, peri)
+        ]
+        keep = np.fromiter((len(a) == vertices for a in approx), dtype=bool, count=len(approx))
+        self.select(keep)
+        return [a for a, k in zip(approx, keep) if k]
+
+
 class SquareDetector:
     """
     Detect squares in a given mask by finding contours.
     """    
     def detect(self, mask: np.ndarray, p: dict) -> List[Dict[str, Any]]:
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        out = []
+        f = ContourFeatures(contours)
         eps_scale = p["s_eps"] / 1000.0
 
-        for cnt in contours:
-            if (
-                len(cv2.approxPolyDP(cnt, eps_scale * cv2.arcLength(cnt, True), True))
-                != 4
-            ):
-                continue
+        area = f.area()
+        f.select((p["s_min_area"] <= area) & (area <= p["s_max_area"]))
+        f.polygons(eps_scale, 4)
+        if not len(f):
+            return []
 
-            area = cv2.contourArea(cnt)
-            if not (p["s_min_area"] <= area <= p["s_max_area"]):
-                continue
-            hull_area = cv2.contourArea(cv2.convexHull(cnt))
-            if (
-                hull_area == 0
-                or (area / hull_area) < p.get("s_sol", 80) / 100.0
-            ):
-                continue
+        area, hull_area = f.area(), f.hull_area()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f.select((hull_area > 0) & (area / hull_area >= p.get("s_sol", 80) / 100.0))
 
-            peri = cv2.arcLength(cnt, True)
+            area, peri = f.area(), f.perimeter()
             circ = 4 * np.pi * area / (peri * peri + 1e-6)
-            if circ * 100 > p["s_circ"]:
-                continue
+            f.select(circ * 100 <= p["s_circ"])
 
-            (cx, cy), (w, h), angle = cv2.minAreaRect(cnt)
-            if w < h:
-                w, h = h, w
-                angle += 90.0
-            angle %= 180.0
-            if (area / (w * h)) < p.get("s_ext", 70) / 100.0:
-                continue
+            cx, cy, w, h, angle = f.min_area_rect()
+            area = f.area()
+            keep = area / (w * h) >= p.get("s_ext", 70) / 100.0
+        f.select(keep)
 
-            r = (w + h) / 4
-            out.append({"cx": cx, "cy": cy, "r": r, "w": w, "h": h, "angle": angle})
-        return out
+        cx, cy, w, h, angle = f.min_area_rect()
+        r = (w + h) / 4
+        return [
+            {"cx": float(cx[i]), "cy": float(cy[i]), "r": float(r[i]),
+             "w": float(w[i]), "h": float(h[i]), "angle": float(angle[i])}
+            for i in range(len(f))
+        ]
 
 
 class RectangleDetector:
     def detect(self, mask: np.ndarray, p: dict) -> List[Dict[str, Any]]:
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        out = []
 
         eps_scale  = p["r_eps"] / 1000.0
         min_area   = p["r_min_area"]
@@ -183,52 +282,51 @@ class RectangleDetector:
         ar_min     = p["r_asp_min"] / 100.0
         ar_max     = p["r_asp_max"] / 100.0
 
-        for cnt in contours:
-            approx = cv2.approxPolyDP(cnt, eps_scale * cv2.arcLength(cnt, True), True)
-            if len(approx) != 4:
-                continue
+        # The polygon's vertices are contour points, so its area is bounded by the contour's extent
+        f = ContourFeatures(contours)
+        f.select(f.box_area() >= min_area)
+        g = ContourFeatures(f.polygons(eps_scale, 4))
 
-            area = cv2.contourArea(approx)
-            if not (min_area <= area <= max_area):
-                continue
+        area = g.area()
+        g.select((min_area <= area) & (area <= max_area))
+        if not len(g):
+            return []
 
-            hull_area = cv2.contourArea(cv2.convexHull(approx))
-            if hull_area == 0 or (area / hull_area) < min_sol:
-                continue
+        area, hull_area = g.area(), g.hull_area()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            g.select((hull_area > 0) & (area / hull_area >= min_sol))
 
-            (cx, cy), (w, h), angle = cv2.minAreaRect(approx)
-            if w < h:
-                w, h = h, w
-                angle += 90.0
-            angle %= 180.0
-            if h == 0:
-                continue
+            cx, cy, w, h, angle = g.min_area_rect()
+            g.select(h != 0)
 
+            cx, cy, w, h, angle = g.min_area_rect()
             aspect = w / h
-            if not (ar_min <= aspect <= ar_max):
-                continue
+            g.select((ar_min <= aspect) & (aspect <= ar_max))
 
-            if (area / (w * h)) < min_extent:
-                continue
+            cx, cy, w, h, angle = g.min_area_rect()
+            g.select(g.area() / (w * h) >= min_extent)
 
-            peri = cv2.arcLength(approx, True)
+            area, peri = g.area(), g.perimeter()
             circ = 4 * np.pi * area / (peri * peri + 1e-6) * 100
-            if circ > circ_thr:
-                continue
-
-            r = (w + h) / 4.0
-            out.append({
-                "cx": float(cx),
-                "cy": float(cy),
-                "r":  float(r),
-                "w":  float(w),
-                "h":  float(h),
-                "angle": float(angle),
-                "aspect_ratio": float(aspect),
-                "area": float(area),
+            g.select(circ <= circ_thr)
+
+        cx, cy, w, h, angle = g.min_area_rect()
+        area = g.area()
+        r = (w + h) / 4.0
+        return [
+            {
+                "cx": float(cx[i]),
+                "cy": float(cy[i]),
+                "r":  float(r[i]),
+                "w":  float(w[i]),
+                "h":  float(h[i]),
+                "angle": float(angle[i]),
+                "aspect_ratio": float(w[i] / h[i]),
+                "area": float(area[i]),
                 "shape": "rectangle",
-            })
-        return out
+            }
+            for i in range(len(g))
+        ]
 
 
 
@@ -284,6 +382,77 @@ class DetectColor:
 
 
 
+# Slider names of each color's HSV range: (hue ranges, saturation range, value range).
+# Red wraps around hue 0, so it has two hue ranges sharing one S/V range.
+HSV_RANGE_KEYS: Dict[str, tuple] = {
+    "red": ((("R1 H min", "R1 H max"), ("R2 H min", "R2 H max")), ("R S min", "R S max"), ("R V min", "R V max")),
+    "blue": ((("B H min", "B H max"),), ("B S min", "B S max"), ("B V min", "B V max")),
+    "green": ((("G H min", "G H max"),), ("G S min", "G S max"), ("G V min", "G V max")),
+    "yellow": ((("Y H min", "Y H max"),), ("Y S min", "Y S max"), ("Y V min", "Y V max")),
+    "neon_yellow": ((("N H min", "N H max"),), ("N S min", "N S max"), ("N V min", "N V max")),
+}
+
+
+class ColorSegmenter:
+    """
+    Segments every color in one pass over the HSV image.
+    Each color owns one bit of a uint8 label map. Per-channel lookup tables give,
+    for each H, S and V value, the colors whose range contains it; AND-ing the
+    three channels sets bit i exactly where DetectColor's inRange would for color i.
+    Tables are rebuilt only when the HSV sliders change.
+    """
+    MAX_COLORS = 8
+
+    def __init__(self) -> None:
+        self.bits: Dict[str, int] = {}
+        self._key: Optional[tuple] = None
+        self._lut = np.zeros((256, 1, 3), dtype=np.uint8)
+
+    def compile(self, params: dict) -> None:
+        """
+        Build the lookup tables from the slider values of every color that has them.
+        """
+        key = tuple(
+            (colour, tuple(params[k] for rng in (*hue, sat, val) for k in rng))
+            for colour, (hue, sat, val) in HSV_RANGE_KEYS.items()
+            if all(k in params for rng in (*hue, sat, val) for k in rng)
+        )[: self.MAX_COLORS]
+        if key == self._key:
+            return
+
+        lut = np.zeros((256, 1, 3), dtype=np.uint8)
+        bits: Dict[str, int] = {}
+        idx = np.arange(256)
+        for i, (colour, _) in enumerate(key):
+            bit = 1 << i
+            hue, sat, val = HSV_RANGE_KEYS[colour]
+            for ch, ranges in enumerate((hue, (sat,), (val,))):
+                for lo, hi in ranges:
+                    inside = (idx >= int(params[lo])) & (idx <= int(params[hi]))
+                    lut[inside, 0, ch] |= bit
+            bits[colour] = bit
+
+        self._lut, self.bits, self._key = lut, bits, key
+
+    def label_map(self, hsv: np.ndarray, params: dict) -> np.ndarray:
+        """
+        uint8 map where bit i is set if the pixel lies in color i's HSV range.
+        """
+        self.compile(params)
+        h, s, v = cv2.split(cv2.LUT(hsv, self._lut))
+        return cv2.bitwise_and(cv2.bitwise_and(h, s), v)
+
+    def mask(self, labels: np.ndarray, colour: str) -> np.ndarray:
+        """
+        0/255 mask of one color from a label map.
+        """
+        return cv2.compare(cv2.bitwise_and(labels, self.bits[colour]), 0, cv2.CMP_GT)
+
+
+SEGMENTER = ColorSegmenter()
+MORPHOLOGY = PreprocessPipeline()   # cached kernels for mask cleaning
+
+
 def color_mask(hsv: np.ndarray, colour: str, params: dict) -> np.ndarray:
     """
     Get the color mask for a specified color from the HSV image.
@@ -297,35 +466,293 @@ def color_mask(hsv: np.ndarray, colour: str, params: dict) -> np.ndarray:
         return np.zeros_like(hsv[:, :, 0])
 
 
+class MaskCache:
+    """
+    Per-frame cache of the HSV image and color masks.
+    Each mask is built once per frame, keyed by (color, morphology params),
+    and shared by the detectors, position estimation and the debug view.
+    """
+    def __init__(self, frame_bgr: np.ndarray, params: dict):
+        self.frame_bgr = frame_bgr
+        self.params = params
+        self._hsv = None
+        self._labels = None
+        self._masks: Dict[tuple, np.ndarray] = {}
+        self._crops: Dict[tuple, "MaskCache"] = {}
+
+    @property
+    def hsv(self) -> np.ndarray:
+        if self._hsv is None:
+            self._hsv = cv2.cvtColor(self.frame_bgr, cv2.COLOR_BGR2HSV)
+        return self._hsv
+
+    @property
+    def labels(self) -> np.ndarray:
+        """
+        Label map of all colors from the shared ColorSegmenter.
+        """
+        if self._labels is None:
+            self._labels = SEGMENTER.label_map(self.hsv, self.params)
+        return self._labels
+
+    def raw(self, colour: str) -> np.ndarray:
+        """
+        Color mask before morphology.
+        """
+        key = (colour, None)
+        if key not in self._masks:
+            labels = self.labels
+            if colour in SEGMENTER.bits:
+                self._masks[key] = SEGMENTER.mask(labels, colour)
+            else:
+                self._masks[key] = color_mask(self.hsv, colour, self.params)
+        return self._masks[key]
+
+    def cleaned(self, colour: str) -> np.ndarray:
+        """
+        Color mask after open/close morphology.
+        """
+        key = (colour, *self.morph_key())
+        if key not in self._masks:
+            self._masks[key] = MORPHOLOGY.clean_mask(self.raw(colour), self.params)
+        return self._masks[key]
+
+    def morph_key(self) -> tuple:
+        p = self.params
+        return int(p.get("kernel_size", 0)), int(p.get("open_iter", 1)), int(p.get("close_iter", 1))
+
+    def crop(self, roi: tuple) -> "MaskCache":
+        """
+        Cache for the (x0, y0, x1, y1) region of this frame.
+        """
+        if roi not in self._crops:
+            x0, y0, x1, y1 = roi
+            self._crops[roi] = MaskCache(self.frame_bgr[y0:y1, x0:x1], self.params)
+        return self._crops[roi]
+
+    def cleaned_in(self, colour: str, rois: List[tuple]) -> np.ndarray:
+        """
+        Full-size cleaned mask computed only inside *rois*, zero elsewhere.
+        Reuses the full-frame mask if it has already been built.
+        """
+        full = self._masks.get((colour, *self.morph_key()))
+        if full is not None:
+            return full
+        key = (colour, *self.morph_key(), tuple(rois))
+        if key not in self._masks:
+            out = np.zeros(self.frame_bgr.shape[:2], dtype=np.uint8)
+            for x0, y0, x1, y1 in rois:
+                dst = out[y0:y1, x0:x1]
+                cv2.bitwise_or(dst, self.crop((x0, y0, x1, y1)).cleaned(colour), dst=dst)
+            self._masks[key] = out
+        return self._masks[key]
+
+
 register_detector("circle", CircleDetector())
 register_detector("square", SquareDetector())
 register_detector("rectangle", RectangleDetector())
 
 
 
-def detect_objects(frame_bgr: np.ndarray, params: dict) -> List[dict]:
+def detect_objects(
+    frame_bgr: np.ndarray,
+    params: dict,
+    cache: Optional[MaskCache] = None,
+    windows: Optional[Dict[Tuple[str, str], List[Roi]]] = None,
+) -> List[dict]:
     """
     Detect objects in a frame using color and shape detectors.
+    Pass a MaskCache to share the color masks with later stages.
+    *windows* limits the search per (shape, color): a list of ROIs to search
+    (empty → skip the target); targets not in the dict are searched fully.
+    The blob prefilter and pyramid mode apply inside each window as well.
     """    
-    hsv = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2HSV)
+    if cache is None:
+        cache = MaskCache(frame_bgr, params)
     results = []
     for tgt in TRACK_TARGETS:
         shape = tgt["shape"]
         color = tgt["color"]
-        mask = color_mask(hsv, color, params)
-        mask = morph(mask, params)
-        if mask is None or not isinstance(mask, np.ndarray) or mask.size == 0:
+        rois = None if windows is None else windows.get((shape, color))
+        if rois is None:
+            mask = cache.cleaned(color)
+            if mask is None or not isinstance(mask, np.ndarray) or mask.size == 0:
+                continue
+            found = detect_shape(mask, shape, params)
+        elif rois and shape in DETECTOR_REGISTRY:
+            rois = merge_rois(rois)
+            mask = cache.cleaned_in(color, rois)
+            found = detect_shape_in_rois(mask, shape, rois, params)
+        else:
             continue
-        for shp_data in detect_shape(mask, shape, params):
-            results.append({"shape": shape, "color": color, "data": shp_data})
+        for shp_data in found:
+            results.append({"shape": shape, "color": color, "data": shp_data, "mask": mask})
     return results
 
 
-def detect_shape(mask: np.ndarray, shape: str, params: dict) -> List[dict]:
+# Slider holding each detector's minimum object area, used by the blob prefilter
+BLOB_MIN_AREA_KEY = {"circle": "c_area", "square": "s_min_area", "rectangle": "r_min_area"}
+
+
+def merge_rois(rois: List[Roi]) -> List[Roi]:
+    """
+    Merge overlapping boxes until none overlap.
+    """
+    rois = list(rois)
+    merged = True
+    while merged:
+        merged = False
+        out: List[Roi] = []
+        for r in rois:
+            for i, o in enumerate(out):
+                if r[0] < o[2] and o[0] < r[2] and r[1] < o[3] and o[1] < r[3]:
+                    out[i] = (min(r[0], o[0]), min(r[1], o[1]), max(r[2], o[2]), max(r[3], o[3]))
+                    merged = True
+                    break
+            else:
+                out.append(r)
+        rois = out
+    return rois
+
+
+def intersect_rois(a: List[Roi], b: List[Roi]) -> List[Roi]:
+    """
+    Pairwise intersections of two ROI lists, merged.
+    """
+    out = []
+    for ax0, ay0, ax1, ay1 in a:
+        for bx0, by0, bx1, by1 in b:
+            x0, y0, x1, y1 = max(ax0, bx0), max(ay0, by0), min(ax1, bx1), min(ay1, by1)
+            if x0 < x1 and y0 < y1:
+                out.append((x0, y0, x1, y1))
+    return merge_rois(out)
+
+
+def find_blob_rois(mask: np.ndarray, min_area: float, pad: int = BLOB_ROI_PAD) -> List[Roi]:
+    """
+    Padded bounding boxes of connected blobs with at least *min_area* pixels.
+    """
+    if cv2.countNonZero(mask) < max(min_area, 1):
+        return []
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if n <= 1:
+        return []
+    stats = stats[1:]
+    stats = stats[stats[:, cv2.CC_STAT_AREA] >= min_area]
+    h, w = mask.shape[:2]
+    x0 = np.maximum(stats[:, cv2.CC_STAT_LEFT] - pad, 0)
+    y0 = np.maximum(stats[:, cv2.CC_STAT_TOP] - pad, 0)
+    x1 = np.minimum(stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH] + pad, w)
+    y1 = np.minimum(stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT] + pad, h)
+    return merge_rois([tuple(map(int, r)) for r in zip(x0, y0, x1, y1)])
+
+
+def detect_in_rois(det: Detector, mask: np.ndarray, rois: List[Roi], params: dict) -> List[dict]:
+    """
+    Run a detector inside each ROI and map the results back to full-frame coordinates.
+    """
+    out = []
+    for x0, y0, x1, y1 in rois:
+        for d in det.detect(mask[y0:y1, x0:x1], params):
+            d["cx"] = float(d["cx"]) + x0
+            d["cy"] = float(d["cy"]) + y0
+            out.append(d)
+    return out
+
+
+# Slider values that scale with image size on a pyramid level (Hough votes grow with circumference)
+PYRAMID_LENGTH_KEYS = ("minDist", "minRadius", "maxRadius", "gaussian_k", "param2")
+PYRAMID_AREA_KEYS = ("c_area", "s_min_area", "s_max_area", "r_min_area", "r_max_area")
+
+
+def pyramid_factor(params: dict) -> int:
+    """
+    Largest power-of-two downscale that keeps minRadius at or above PYRAMID_MIN_RADIUS_PX.
+    """
+    min_r = float(params.get("minRadius", 0))
+    s = 1
+    while min_r / (2 * s) >= PYRAMID_MIN_RADIUS_PX:
+        s *= 2
+    return s
+
+
+def scale_params(params: dict, s: int) -> dict:
+    """
+    Copy of *params* with lengths divided by *s* and areas by *s*².
+    """
+    p = dict(params)
+    for k in PYRAMID_LENGTH_KEYS:
+        if k in p:
+            p[k] = max(1, int(round(p[k] / s)))
+    for k in PYRAMID_AREA_KEYS:
+        if k in p:
+            p[k] = p[k] / (s * s)
+    return p
+
+
+def detect_pyramid(det: Detector, mask: np.ndarray, params: dict, s: Optional[int] = None) -> List[dict]:
+    """
+    Find candidates on the mask downscaled by *s*, then rerun the detector at full
+    resolution only in a window around each candidate.
+    """
+    s = pyramid_factor(params) if s is None else s
+    if s <= 1:
+        return det.detect(mask, params)
+    h, w = mask.shape[:2]
+    small = cv2.resize(mask, (max(1, w // s), max(1, h // s)), interpolation=cv2.INTER_AREA)
+    _, small = cv2.threshold(small, 127, 255, cv2.THRESH_BINARY)
+
+    rois = []
+    for c in det.detect(small, scale_params(params, s)):
+        cx, cy = (float(c["cx"]) + 0.5) * s, (float(c["cy"]) + 0.5) * s
+        half = 1.2 * float(c["r"]) * s + 2 * s + BLOB_ROI_PAD
+        x0, y0 = max(0, int(cx - half)), max(0, int(cy - half))
+        x1, y1 = min(w, int(cx + half) + 1), min(h, int(cy + half) + 1)
+        if x0 < x1 and y0 < y1:
+            rois.append((x0, y0, x1, y1))
+    return detect_in_rois(det, mask, merge_rois(rois), params)
+
+
+def detect_shape(
+    mask: np.ndarray,
+    shape: str,
+    params: dict,
+    prefilter: Optional[bool] = None,
+    pyramid: Optional[bool] = None,
+) -> List[dict]:
     """
     Detect a specific shape in a mask.
+    With pyramid mode (PYRAMID_MODE, or *pyramid* if given) candidates come from a
+    downscaled mask and are refined at full resolution. Otherwise, with the blob
+    prefilter (BLOB_PREFILTER, or *prefilter*) the detector only runs inside padded
+    ROIs of large enough blobs.
     """    
     det = DETECTOR_REGISTRY.get(shape)
     if det is None:
         return []
-    return det.detect(mask, params)
+    if pyramid is None:
+        pyramid = PYRAMID_MODE.get(shape, False)
+    if pyramid:
+        return detect_pyramid(det, mask, params)
+    if prefilter is None:
+        prefilter = BLOB_PREFILTER.get(shape, False)
+    if not prefilter:
+        return det.detect(mask, params)
+    min_area = float(params.get(BLOB_MIN_AREA_KEY.get(shape, ""), 0))
+    rois = find_blob_rois(mask, min_area)
+    if not rois:
+        return []
+    return detect_in_rois(det, mask, rois, params)
+
+
+def detect_shape_in_rois(mask: np.ndarray, shape: str, rois: List[Roi], params: dict) -> List[dict]:
+    """
+    detect_shape inside each ROI, results in full-frame coordinates.
+    """
+    out = []
+    for x0, y0, x1, y1 in rois:
+        for d in detect_shape(mask[y0:y1, x0:x1], shape, params):
+            d["cx"] = float(d["cx"]) + x0
+            d["cy"] = float(d["cy"]) + y0
+            out.append(d)
+    return out
@@ -81,7 +81,7 @@ def get_runtime_params(groups: List[str] | None = None) -> Dict[str, Any]:
         "Depth Weight": 66, "Depth Mask Weight": 100,
         "Tracker Weight": 100, "Decision Accept Threshold": 300,
         "focus": 130, "tr_alpha": 5, "match_dist": 1500, "max_lost": 30,
-        "spawn_persist": 0, "speed_gain": 0, "stable_age": 2,
+        "spawn_persist": 0, "cand_ttl": 10, "speed_gain": 0, "stable_age": 2,
         "kf_q_2d": 2, "kf_r_2d": 5, "kf_q_3d": 10, "kf_r_3d": 9,
         "clahe_clip": 0, "gaussian_k": 5, "gaussian_sigma": 0, "gray": 1
     }
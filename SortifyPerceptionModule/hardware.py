@@ -30,6 +30,7 @@ class DepthAICamera:
         self.q_depth = None
         self.q_control = None
         self._fx = self._fy = self._cx0 = self._cy0 = 0.0
+        self._dist = None
 
     # Start camera device and queues
     def start(self):
@@ -105,6 +106,9 @@ class DepthAICamera:
         intr   = calib.getCameraIntrinsics(socket, self.width, self.height)
         self._fx, self._fy = intr[0][0], intr[1][1]
         self._cx0, self._cy0 = intr[0][2], intr[1][2]
+        # OpenCV's undistortPoints only understands the perspective model; others fall back to pinhole
+        if calib.getDistortionModel(socket) == dai.CameraModel.Perspective:
+            self._dist = calib.getDistortionCoefficients(socket)
 
 
     # Return camera intrinsics (fx, fy, cx, cy)
@@ -112,7 +116,12 @@ class DepthAICamera:
         return self._fx, self._fy, self._cx0, self._cy0
 
 
-    # Get latest RGB and depth frames
+    # Return lens distortion coefficients (OpenCV order), None if unknown
+    def get_distortion(self):
+        return self._dist
+
+
+    # Get latest RGB and depth frames as arrays, plus the RGB capture timestamp (s, host clock)
     def get_latest_frames(self):
         in_video = in_depth = None
         while self.q_video.has():
@@ -123,7 +132,7 @@ class DepthAICamera:
             in_video = self.q_video.get()
         if in_depth is None:
             in_depth = self.q_depth.get()
-        return in_video, in_depth
+        return in_video.getCvFrame(), in_depth.getFrame(), in_video.getTimestamp().total_seconds()
 
 
     # Set camera focus, auto or manual
@@ -69,7 +69,7 @@ class ObjectStats:
             row["pos_error_mm"] = f"{pos_err:.2f}" if isinstance(pos_err, float) else pos_err
 
             for key in ("track_id", "shape", "color", "x_mm", "y_mm", "z_mm", 
-                        "depth_valid", "depth_mask_valid", "color_valid", "shape_valid"):
+                        "depth_valid", "depth_mask_valid", "depth_inliers", "color_valid", "shape_valid"):
                 row[key] = detection.get(key, "NA")
 
         self.writer.writerow([row.get(col, "NA") for col in LOG_COLUMNS])
@@ -0,0 +1,128 @@
+"""
+motion.py
+
+Motion gating for the perception loop.
+Diffs a downsampled frame tile by tile against the last processed
+content, so detection only runs where the scene changed.
+"""
+
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from config import (
+    MOTION_TILE_PX, MOTION_DOWNSCALE, MOTION_PIXEL_THRESH,
+    MOTION_TILE_MIN_PIXELS, MOTION_REFRESH_INTERVAL,
+)
+from detection import Roi, merge_rois
+
+
+class MotionGate:
+    """
+    Tile-wise change detector.
+    update() returns None when the whole frame must be processed, [] when no
+    tile changed, and otherwise the changed tiles as full-resolution ROIs.
+    A tile's reference only moves on when the tile is processed, so slow drift
+    still adds up to a change.
+    """
+    def __init__(
+        self,
+        tile_px: int = MOTION_TILE_PX,
+        downscale: int = MOTION_DOWNSCALE,
+        pixel_thresh: int = MOTION_PIXEL_THRESH,
+        tile_min_pixels: int = MOTION_TILE_MIN_PIXELS,
+        refresh_interval: int = MOTION_REFRESH_INTERVAL,
+    ) -> None:
+        self.downscale = max(1, int(downscale))
+        self.tile = max(1, int(tile_px) // self.downscale)   # tile size on the small frame
+        self.pixel_thresh = pixel_thresh
+        self.tile_min_pixels = tile_min_pixels
+        self.refresh_interval = refresh_interval
+        self.ref: Optional[np.ndarray] = None
+        self.frames_since_full = 0
+        self.processed_px = 0
+        self.skipped_px = 0
+        self.static_frames = 0
+        self.frames = 0
+
+    def reset(self) -> None:
+        self.ref = None
+
+    def update(self, frame_bgr: np.ndarray) -> Optional[List[Roi]]:
+        h, w = frame_bgr.shape[:2]
+        d, t = self.downscale, self.tile
+        small = cv2.resize(frame_bgr, (max(1, w // d), max(1, h // d)), interpolation=cv2.INTER_AREA)
+        self.frames += 1
+
+        if self.ref is None or self.ref.shape != small.shape or self.frames_since_full >= self.refresh_interval:
+            self.ref = small
+            self.frames_since_full = 0
+            self.processed_px += h * w
+            return None
+        self.frames_since_full += 1
+
+        # Changed-pixel count per tile (frame padded to whole tiles). Largest change over
+        # the color channels, since a colored object can match the background in gray.
+        diff = cv2.absdiff(small, self.ref)
+        if diff.ndim == 3:
+            diff = diff.max(axis=2)
+        sh, sw = diff.shape
+        gh, gw = -(-sh // t), -(-sw // t)
+        changed = np.zeros((gh * t, gw * t), dtype=np.uint8)
+        cv2.compare(diff, self.pixel_thresh, cv2.CMP_GT, dst=changed[:sh, :sw])
+        counts = (changed.reshape(gh, t, gw, t) > 0).sum(axis=(1, 3))
+        tiles = np.argwhere(counts >= self.tile_min_pixels)
+
+        rois: List[Roi] = []
+        step = t * d
+        for ty, tx in tiles:
+            self.ref[ty * t:(ty + 1) * t, tx * t:(tx + 1) * t] = small[ty * t:(ty + 1) * t, tx * t:(tx + 1) * t]
+            rois.append((int(tx * step), int(ty * step), int(min(w, (tx + 1) * step)), int(min(h, (ty + 1) * step))))
+
+        area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rois)
+        self.processed_px += area
+        self.skipped_px += h * w - area
+        if not rois:
+            self.static_frames += 1
+        return rois
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Processed vs. skipped area since start (pixels) and the skipped fraction.
+        """
+        total = self.processed_px + self.skipped_px
+        return {
+            "frames": self.frames,
+            "static_frames": self.static_frames,
+            "processed_px": self.processed_px,
+            "skipped_px": self.skipped_px,
+            "skipped_frac": self.skipped_px / total if total else 0.0,
+        }
+
+
+def object_box(data: dict) -> Roi:
+    """
+    Integer bounding box of a detection from its center and radius.
+    """
+    cx, cy, r = float(data["cx"]), float(data["cy"]), float(data.get("r", 0))
+    return int(cx - r), int(cy - r), int(cx + r) + 1, int(cy + r) + 1
+
+
+def touches_any(data: dict, rois: List[Roi]) -> bool:
+    """
+    True if the detection's bounding box overlaps any of *rois*.
+    """
+    bx0, by0, bx1, by1 = object_box(data)
+    return any(bx0 < x1 and x0 < bx1 and by0 < y1 and y0 < by1 for x0, y0, x1, y1 in rois)
+
+
+def pad_rois(rois: List[Roi], pad: int, shape) -> List[Roi]:
+    """
+    Grow each ROI by *pad* px (clipped to the frame) and merge overlaps.
+    """
+    h, w = shape[:2]
+    return merge_rois([
+        (max(0, x0 - pad), max(0, y0 - pad), min(w, x1 + pad), min(h, y1 + pad))
+        for x0, y0, x1, y1 in rois
+    ])
@@ -4,26 +4,34 @@ Controls the whole perception system. Takes camera frames, processes them,
 finds objects, checks with AI if needed, keeps track of objects, and sends the results to the robot.
 Author: Azi Sami (2025)
 """
-from typing import List, Dict, Tuple
-import time, math, cv2, numpy as np
+from typing import List, Dict, Optional, Tuple
+import time, math, logging, threading, cv2, numpy as np
 
 from debug_visualization import draw_scoring_overlay
-from position_estimation import transform_camera_to_robot, estimate_position
-from preprocessing import preprocess                        
-from detection import detect_objects, DetectColor
+from position_estimation import transform_camera_to_robot, estimate_positions, EXTRINSICS, RayTable
+from preprocessing import PreprocessPipeline
+from detection import detect_objects, intersect_rois, MaskCache
+from motion import MotionGate, object_box, pad_rois, touches_any
+from workspace import Workspace
 from scoring_controller import DecisionResult, merge_detection_info
-from shape_tracker import ShapeTracker
+from shape_tracker import MultiClassTracker, CheckpointWriter
 from debug_visualization import draw_detections, build_debug_view
 from gui_interface import create_trackbars, get_runtime_params
 from logging_handler import logger as console_logger, KPIBatchLogger
 from ros_wrapper import ROSInterface, ros_shutdown
-from yolo_verification import run_yolo_inference         
+from yolo_verification import run_yolo_inference, AsyncYoloWorker
+from pipeline import EndOfInput, FramePacket, FramePipeline, FramePool
+from watchdog import DeadlineWatchdog
 from config import (
     CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_FPS,
     SLIDER_CONFIG, TRACKBAR_WINDOW, TRACK_TARGETS, ACTIVE_GROUPS,
     LOGGING_TOGGLE_KEY, LOGGING_MAX_FRAMES_DEFAULT,
-    DEPTH_MIN_MM, DEPTH_MAX_MM, GROUND_TRUTH_POS,
-    USE_GUI, USE_TRACKBARS, ENABLE_YOLO, MODE, DRAW_DETECTIONS, DRAW_SCORING, DEBUG_LAYOUT
+    GROUND_TRUTH_POS,
+    USE_GUI, USE_TRACKBARS, ENABLE_YOLO, YOLO_ASYNC, YOLO_MAX_LAG_FRAMES, MODE, DRAW_DETECTIONS, DRAW_SCORING, DEBUG_LAYOUT,
+    PIPELINE_MODE, PIPELINE_QUEUE_SIZE, PIPELINE_DROP_OLDEST,
+    TRACKER_GUIDED_DETECTION, GUIDED_RESCAN_INTERVAL, GUIDED_SIGMA, GUIDED_MARGIN_PX,
+    MOTION_GATING, MOTION_ROI_PAD, WORKSPACE_ROIS,
+    TRACK_CHECKPOINT_PATH, TRACK_CHECKPOINT_INTERVAL_S, TRACK_CHECKPOINT_MAX_AGE_S,
 )
 
 DetectionData = Dict[str, float]
@@ -50,14 +58,46 @@ class PerceptionController:
             self.udp_sock2.bind((self.udp_ip, self.udp_port2))
 
         self.yolo_verified_buffer = [] 
+        self.yolo_worker = AsyncYoloWorker() if ENABLE_YOLO and YOLO_ASYNC else None
         self._fx = self._fy = self._cx0 = self._cy0 = 0.0
+        self.rays = None  # per-pixel ray table, built from the calibration in sortify mode
         self._prev_focus = -1
-        self.trackers: Dict[Tuple[str, str], ShapeTracker] = {
-            (t["shape"], t["color"]): ShapeTracker() for t in TRACK_TARGETS
-        }
+        self.tracker = MultiClassTracker()   # all TRACK_TARGETS classes, one assignment per frame
+        # Read-only tracker copy for the detect and YOLO stages, swapped in by track_stage
+        self.track_snapshot = self.tracker.snapshot()
+        # Signalled when track_stage publishes a snapshot or a frame is dropped before it,
+        # so pipelined guided detection can wait for the previous frame's tracks
+        self.track_cond = threading.Condition()
+        self.dropped_frames: set = set()
+        self.last_checkpoint = time.time()
+        # Checkpoints are copied on the track thread and written on this writer's thread
+        self.checkpoint_writer = CheckpointWriter(
+            TRACK_CHECKPOINT_PATH,
+            on_error=lambda e: console_logger.warning(f"Tracker checkpoint failed: {e}"),
+        )
         self.global_frame_counter = 0
+        self.cached_params = None
+        self.pipeline = None
+        self.last_full_scan = -GUIDED_RESCAN_INTERVAL
+        self.motion_gate = MotionGate() if MOTION_GATING else None
+        # Preprocessed frames stay referenced until rendered (and by the motion gate's last
+        # frame), so the output ring covers every frame that can be in flight
+        in_flight = 3 * (PIPELINE_QUEUE_SIZE + 1) + 2 if PIPELINE_MODE else 2
+        self.preprocessor = PreprocessPipeline(ring_size=in_flight)
+        self.last_detect: Optional[FramePacket] = None
+        self.last_yolo_dets: List[dict] = []
+        self.fps_timer = time.time()
+        self.fps_count = 0
+        self.fps_avg = 0.0
         self.kpi_logger = None
         self.logging_start_frame = None
+        self.pool = FramePool()          # overlay/debug/capture buffers, recycled after rendering
+        self.frame_shape = None
+        self.workspace: Optional[Workspace] = None
+        self.frame_allocs = 0
+        self._depth_dummy = None
+        self._stream_clock: Optional[bool] = None   # demo: use the video's own timestamps?
+        self.watchdog = DeadlineWatchdog()   # stage deadlines, one thread for the whole loop
 
     def initialize(self) -> None:
         """
@@ -66,17 +106,39 @@ class PerceptionController:
         if USE_GUI and USE_TRACKBARS:
             cv2.namedWindow(TRACKBAR_WINDOW, cv2.WINDOW_NORMAL)
             create_trackbars(SLIDER_CONFIG, groups=ACTIVE_GROUPS)
-        for tr in self.trackers.values():
-            tr.clear()
-        ShapeTracker.id_counter = 0
+        self.tracker.clear()
+        self.tracker.frame_period = self.frame_period()
+        if TRACKER_GUIDED_DETECTION:
+            # Candidates must outlive the gap between full scans
+            self.tracker.min_cand_ttl = GUIDED_RESCAN_INTERVAL
+        if MODE in ("sortify", "demo") and TRACK_CHECKPOINT_PATH:
+            age = self.tracker.load_checkpoint(TRACK_CHECKPOINT_PATH, TRACK_CHECKPOINT_MAX_AGE_S)
+            if age is not None:
+                console_logger.info(f"Tracker restored from checkpoint ({age:.1f} s old): {self.tracker.stats()}")
+        self.track_snapshot = self.tracker.snapshot()
+        # Fresh (or restored) tracks: the first frame is detected in full
+        self.last_detect = None
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+        self.watchdog.start()
+        if MODE in ("sortify", "demo") and TRACK_CHECKPOINT_PATH:
+            self.checkpoint_writer.start()
+        if self.yolo_worker is not None:
+            self.yolo_worker.start()
         if MODE == "sortify":
             self.camera.start()
             self._fx, self._fy, self._cx0, self._cy0 = self.camera.get_intrinsics()
+            self.rays = RayTable(
+                self._fx, self._fy, self._cx0, self._cy0, self.camera.get_distortion(),
+                self.camera.width, self.camera.height,
+            )
     
-    def send_output(self, shape, color, data, accepted):
+    def send_output(self, shape, color, data, accepted, robot_xyz=None):
         if MODE == "sortify":
             if self.ros and all(k in data for k in ("x_mm", "y_mm", "z_mm")):
-                xr, yr, zr = transform_camera_to_robot(data["x_mm"], data["y_mm"], data["z_mm"])
+                if robot_xyz is None:
+                    robot_xyz = transform_camera_to_robot(data["x_mm"], data["y_mm"], data["z_mm"])
+                xr, yr, zr = (float(v) for v in robot_xyz)
                 self.ros.publish(shape, color, data.get("track_id", 255), xr, yr, zr)
         elif MODE == "safety":
             import socket
@@ -87,21 +149,69 @@ class PerceptionController:
             sock.close()
         # MODE == "demo" → no output
 
-    def get_video_frame(self):
+    def get_video_frame(self, out: Optional[np.ndarray] = None):
+        """
+        Latest color frame, depth frame and capture timestamp in seconds.
+        In demo mode the color frame is read into *out* when given.
+        """
         if MODE == "sortify":
             return self.camera.get_latest_frames()
         elif MODE == "demo":
-            ret, frame = self.video.read()
+            ret, frame = self.video.read(out) if out is not None else self.video.read()
             if not ret:
-                return None, None
-            depth_dummy = np.zeros((frame.shape[0], frame.shape[1]), dtype=np.uint8)
-            return frame, depth_dummy
+                return None, None, None
+            return frame, self.depth_dummy(frame), self.video_timestamp()
         elif MODE == "safety":
             data, _ = self.udp_sock2.recvfrom(65535)
             np_arr = np.frombuffer(data, dtype=np.uint8)
             frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-            depth_dummy = np.zeros_like(frame[:, :, 0])
-            return frame, depth_dummy
+            return frame, self.depth_dummy(frame), time.monotonic()
+        return None, None, None
+
+    def video_timestamp(self) -> float:
+        """
+        Timestamp of the frame just read: the stream's own clock for video
+        files and for cameras whose backend provides one (most V4L2/AVFoundation
+        webcams), otherwise host time at read. Decided once on the first frame
+        so clocks never mix; files report 0 ms there, so they are recognised by
+        their frame count instead.
+        """
+        if self._stream_clock is None:
+            self._stream_clock = (not self.live_source()
+                                  or self.video.get(cv2.CAP_PROP_POS_MSEC) > 0)
+        if self._stream_clock:
+            return self.video.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        return time.monotonic()
+
+    def frame_period(self) -> Optional[float]:
+        """
+        Nominal seconds per camera frame, the tracker's unit of time.
+        None lets the tracker measure it from the first frames.
+        """
+        if MODE == "sortify":
+            return 1.0 / CAMERA_FPS
+        if MODE == "demo":
+            fps = self.video.get(cv2.CAP_PROP_FPS)
+            return 1.0 / fps if fps and fps > 0 else None
+        return None
+
+    def live_source(self) -> bool:
+        """
+        True when frames keep coming whether or not they are read (cameras, UDP),
+        False for video files, whose frames must not be dropped.
+        """
+        if MODE == "demo":
+            return self.video.get(cv2.CAP_PROP_FRAME_COUNT) <= 0
+        return True
+
+    def depth_dummy(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Shared read-only zero depth map for modes without a depth camera.
+        """
+        if self._depth_dummy is None or self._depth_dummy.shape != frame.shape[:2]:
+            self._depth_dummy = np.zeros(frame.shape[:2], dtype=np.uint8)
+            self._depth_dummy.flags.writeable = False
+        return self._depth_dummy
         
     def compute_iou(self, boxA, boxB):
         xA = max(boxA[0], boxB[0])
@@ -118,219 +228,510 @@ class PerceptionController:
 
 
 
-    def process_frames(self) -> None:
-        fps_timer = time.time()
-        fps_count = 0
-        fps_avg = 0.0
-
-        while True:
-            # 1. Get frames
-            color_frame, depth_frame = self.get_video_frame()
-            if color_frame is None or depth_frame is None:
-                raise RuntimeError("Camera returned None frame.")
-
-
-            if self.global_frame_counter % 3 == 0:
-                self.cached_params = get_runtime_params()
-            params = self.cached_params
-
-            if color_frame is None or depth_frame is None:
-                raise RuntimeError("Camera returned None frame.")
-            base_image = color_frame.copy()
-
-            # 2. Preprocess
-            processed = preprocess(
-                frame_bgr=color_frame,
-                use_clahe=params["clahe_clip"] > 0,
-                clahe_clip=float(params["clahe_clip"]),
-                blur_k=int(params["gaussian_k"]),
-                use_gray=False,
-            )
-
-            # 3. Detect objects (classic CV)
-            detections_raw: List[DetectionObj] = detect_objects(processed, params)
-            detections_post: List[DetectionObj] = []
+    def refresh_params(self) -> None:
+        if self.cached_params is None or self.global_frame_counter % 3 == 0:
+            self.cached_params = get_runtime_params()
 
+    def process_frames(self) -> None:
+        if PIPELINE_MODE:
+            self.process_frames_pipelined()
+            return
+
+        try:
+            while True:
+                self.refresh_params()
+                pkt = self.capture_stage()
+                self.detect_stage(pkt)
+                self.yolo_stage(pkt)
+                self.track_stage(pkt)
+                stop = self.render_stage(pkt)
+                self.pool.release_packet(pkt)
+                if stop:
+                    break
+        finally:
+            self.shutdown()
 
-            # 4. Position/filter
-            for obj in detections_raw:
-                data2d = obj["data"]
-                pos3d = estimate_position(
-                    data2d, depth_frame,
-                    fx=self._fx, fy=self._fy, cx0=self._cx0, cy0=self._cy0,
-                    mask=obj.get("mask") or data2d.get("mask"),
-                )
-                data2d["depth_mask_valid"] = pos3d["depth_mask_valid"]
-                merged = merge_detection_info(obj, data2d, pos3d)
-                obj["data"] = merged
-                detections_post.append(obj)
+    def process_frames_pipelined(self) -> None:
+        """
+        Same stages as process_frames, each on its own thread.
+        Rendering and GUI stay on the main thread.
+        """
+        def render_and_refresh(pkt: FramePacket) -> bool:
+            stop = self.render_stage(pkt)
+            self.pool.release_packet(pkt)
+            self.refresh_params()
+            return stop
+
+        def discard(pkt: FramePacket) -> None:
+            self.pool.release_packet(pkt)
+            if TRACKER_GUIDED_DETECTION:
+                with self.track_cond:
+                    self.dropped_frames.add(pkt.frame_id)
+                    self.track_cond.notify_all()
+
+        self.refresh_params()
+        self.pipeline = FramePipeline(
+            source=self.capture_stage,
+            stages=[
+                ("detect", self.detect_stage),
+                ("yolo", self.yolo_stage),
+                ("track", self.track_stage),
+            ],
+            sink=render_and_refresh,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            drop_oldest=PIPELINE_DROP_OLDEST and self.live_source(),
+            discard=discard,
+        )
+        try:
+            self.pipeline.run()
+        finally:
+            self.shutdown()
+
+    def capture_stage(self) -> FramePacket:
+        # 1. Get frames (demo mode reads into a pooled buffer once the frame size is known)
+        buf = self.pool.acquire(self.frame_shape) if MODE == "demo" and self.frame_shape else None
+        color_frame, depth_frame, stamp = self.get_video_frame(buf)
+        if buf is not None and color_frame is not buf:
+            self.pool.release(buf)
+            buf = None
+        if color_frame is None or depth_frame is None:
+            raise EndOfInput("Camera returned None frame.")
+        self.frame_shape = color_frame.shape
+        if WORKSPACE_ROIS and (self.workspace is None or self.workspace.frame_shape != color_frame.shape[:2]):
+            self.workspace = Workspace(WORKSPACE_ROIS, color_frame.shape)
+            console_logger.info(self.workspace.summary())
+        self.global_frame_counter += 1
+        pkt = FramePacket(
+            frame_id=self.global_frame_counter,
+            color=color_frame,
+            depth=depth_frame,
+            params=self.cached_params,
+            timestamp=stamp,
+        )
+        if buf is not None:
+            pkt.buffers.append(buf)
+        return pkt
+
+    def detect_stage(self, pkt: FramePacket) -> None:
+        params = pkt.params
+        # Read-only view: only the pooled overlays are drawn on
+        pkt.base_image = pkt.color.view()
+        pkt.base_image.flags.writeable = False
+
+        # 1b. Motion gate: None → full frame, [] → nothing moved, else changed tiles.
+        # New sliders redo the full frame, so the gate starts over from this frame.
+        prev = self.last_detect
+        full = prev is None or prev.params != params
+        if full and self.motion_gate is not None:
+            self.motion_gate.reset()
+        changed = self.motion_changes(pkt)
+        ws = self.workspace
+        if full:
+            changed = None
+        if changed is not None and not changed:
+            pkt.static = True
+            pkt.processed, pkt.masks = prev.processed, prev.masks
+            pkt.detections = [self.carry_over(obj) for obj in prev.detections]
+            self.last_detect = pkt
+            return
+
+        # 2. Preprocess (stages rebuilt only when the sliders change)
+        self.preprocessor.compile(params)
+        if ws is not None:
+            processed = self.preprocessor.run_rois(pkt.color, ws.rects, ws.outside)
+        else:
+            processed = self.preprocessor.run(pkt.color)
+
+        # 3. Detect objects (classic CV), masks shared with later stages
+        masks = MaskCache(processed, params)
+        windows = self.search_windows(pkt)
+        detections_post: List[DetectionObj] = []
+        if changed:
+            # Detections touching a changed tile are redone, the rest carry over
+            redo = [o for o in prev.detections if touches_any(o["data"], changed)]
+            detections_post = [self.carry_over(o) for o in prev.detections if not touches_any(o["data"], changed)]
+            windows = self.motion_windows(changed + [object_box(o["data"]) for o in redo], windows, pkt.color.shape)
+        if ws is not None:
+            windows = self.limit_windows(windows, ws.rects)
+        detections_raw: List[DetectionObj] = detect_objects(processed, params, masks, windows)
+        if changed:
+            detections_raw = [o for o in detections_raw if touches_any(o["data"], changed)]
+        if ws is not None:
+            detections_raw = [o for o in detections_raw if ws.contains(o["data"]["cx"], o["data"]["cy"])]
+
+        # 4. Position/filter (one batch per frame, each object only inside its bounding box)
+        positions = estimate_positions(
+            [obj["data"] for obj in detections_raw], pkt.depth,
+            fx=self._fx, fy=self._fy, cx0=self._cx0, cy0=self._cy0,
+            masks=[obj["mask"] if obj.get("mask") is not None else obj["data"].get("mask") for obj in detections_raw],
+            rays=self.rays,
+        )
+        for obj, pos3d in zip(detections_raw, positions):
+            data2d = obj["data"]
+            data2d["depth_mask_valid"] = pos3d["depth_mask_valid"]
+            merged = merge_detection_info(obj, data2d, pos3d)
+            obj["data"] = merged
+            detections_post.append(obj)
+
+        pkt.processed = processed
+        pkt.masks = masks
+        pkt.detections = detections_post
+        self.last_detect = pkt
+
+    @staticmethod
+    def carry_over(obj: DetectionObj) -> DetectionObj:
+        """
+        Copy of a previous frame's detection that later stages can annotate.
+        """
+        return {**obj, "data": dict(obj["data"])}
 
-            # AI model (optional)
-            overlay_with_yolo = base_image.copy()
-            detections_ai = run_yolo_inference(base_image) if ENABLE_YOLO else []
+    def motion_changes(self, pkt: FramePacket):
+        """
+        Changed tiles from the motion gate (frame coordinates), watching only the workspace if set.
+        """
+        if self.motion_gate is None:
+            return None
+        if self.workspace is None:
+            return self.motion_gate.update(pkt.color)
+        x0, y0, x1, y1 = self.workspace.union
+        changed = self.motion_gate.update(pkt.color[y0:y1, x0:x1])
+        if changed is None:
+            return None
+        return [(a + x0, b + y0, c + x0, d + y0) for a, b, c, d in changed]
+
+    def motion_windows(self, areas, windows, frame_shape):
+        """
+        Detection windows around the changed areas, limited to the tracker windows if any.
+        """
+        return self.limit_windows(windows, pad_rois(areas, MOTION_ROI_PAD, frame_shape))
 
-            verified_this_frame: list[dict] = []
-            matched_ai = [False] * len(detections_ai)          
+    @staticmethod
+    def limit_windows(windows, rois):
+        """
+        Per-target windows clipped to *rois*; a full-frame search (None) becomes *rois*.
+        """
+        if windows is None:
+            return {(t["shape"], t["color"]): list(rois) for t in TRACK_TARGETS}
+        return {key: intersect_rois(w, rois) for key, w in windows.items()}
 
-            for obj in detections_post:
-                if not (ENABLE_YOLO and obj.get("shape")):
-                    obj["data"]["ai_valid"] = False
-                    continue
+    def log_stats(self) -> None:
+        """
+        Debug counters, once a second from the render stage. The tracker's come
+        from its last snapshot, the tracker itself belongs to the track stage.
+        """
+        console_logger.debug(f"Frame pool: {self.frame_allocs} allocations last frame, "
+                             f"{self.pool.allocations} total, {self.pool.in_use} in use")
+        if self.motion_gate is not None:
+            console_logger.debug(f"Motion gate: {self.motion_gate.stats()}")
+        console_logger.debug(f"Stage deadlines: {self.watchdog.stats()}")
+        console_logger.debug(f"Tracker: {self.track_snapshot.stats()}")
+        if self.pipeline is not None:
+            console_logger.debug(f"Pipeline drops: {self.pipeline.dropped()}")
+
+    def search_windows(self, pkt: FramePacket):
+        """
+        Per-target search windows from the trackers' predictions, or None for a full-frame scan.
+        Scans the full frame every GUIDED_RESCAN_INTERVAL frames, when a track is lost,
+        and while no target has a track yet.
+        """
+        if not TRACKER_GUIDED_DETECTION or MODE not in ("sortify", "demo"):
+            return None
+        if pkt.frame_id - self.last_full_scan >= GUIDED_RESCAN_INTERVAL:
+            self.last_full_scan = pkt.frame_id
+            return None
+
+        if self.pipeline is not None and self.last_detect is not None:
+            self.wait_for_track(self.last_detect.frame_id)
+        snap = self.track_snapshot
+        steps = max(1, pkt.frame_id - snap.frame_id)
+        windows = {}
+        for t in TRACK_TARGETS:
+            shape, color = t["shape"], t["color"]
+            rois = snap.search_windows(
+                shape, color, pkt.color.shape, steps=steps,
+                sigma=GUIDED_SIGMA, margin=GUIDED_MARGIN_PX,
+            )
+            if rois is None:
+                self.last_full_scan = pkt.frame_id
+                return None
+            windows[(shape, color)] = rois
+        if not any(windows.values()):
+            self.last_full_scan = pkt.frame_id
+            return None
+        return windows
+
+    def wait_for_track(self, frame_id: int) -> None:
+        """
+        Blocks until the tracker has taken frame *frame_id* or the frame was dropped,
+        so pipelined guided windows come from the same tracks as in process_frames.
+        """
+        with self.track_cond:
+            while (self.track_snapshot.frame_id < frame_id
+                   and frame_id not in self.dropped_frames
+                   and not self.pipeline.stopping()):
+                self.track_cond.wait(0.1)
+            self.dropped_frames = {i for i in self.dropped_frames if i > frame_id}
+
+    def yolo_stage(self, pkt: FramePacket) -> None:
+        # 5. AI model (optional)
+        base_image = pkt.base_image
+        detections_post = pkt.detections
+        overlay_with_yolo = self.pool.copy(base_image)
+        pkt.buffers.append(overlay_with_yolo)
+        detections_ai, lag = self.get_yolo_detections(pkt)
+
+        verified_this_frame: list[dict] = []
+        matched_ai = [False] * len(detections_ai)
+        matched_box: Dict[int, Tuple[int, int, int, int]] = {}
+        snap = self.track_snapshot
+
+        for obj in detections_post:
+            if not (ENABLE_YOLO and obj.get("shape")):
+                obj["data"]["ai_valid"] = False
+                continue
+
+            d = obj["data"]
+            cx, cy, r = int(d["cx"]), int(d["cy"]), int(d.get("r", 40))
+            shape_box = (
+                max(0, cx - r), max(0, cy - r),
+                min(base_image.shape[1], cx + r), min(base_image.shape[0], cy + r)
+            )
 
-                d = obj["data"]
-                cx, cy, r = int(d["cx"]), int(d["cy"]), int(d.get("r", 40))
-                shape_box = (
-                    max(0, cx - r), max(0, cy - r),
-                    min(base_image.shape[1], cx + r), min(base_image.shape[0], cy + r)
+            # Shift boxes from the (older) YOLO frame by the track's motion since then
+            dx = dy = 0
+            if lag > 0:
+                vx, vy = snap.velocity_near(
+                    obj["shape"], obj["color"], d["cx"], d["cy"], max_dist=2 * r
                 )
+                dx, dy = int(round(vx * lag)), int(round(vy * lag))
 
-                best_iou, best_idx = 0.0, -1
-                for idx, det in enumerate(detections_ai):
-                    yolo_box = (det["left"], det["top"], det["right"], det["bottom"])
-                    iou = self.compute_iou(shape_box, yolo_box)
-                    if iou > best_iou:
-                        best_iou, best_idx = iou, idx
-
-                if best_iou > 0.15:
-                    matched_ai[best_idx] = True       
-                    d["ai_valid"] = True
-                else:
-                    d["ai_valid"] = False
-
+            best_iou, best_idx, best_box = 0.0, -1, None
             for idx, det in enumerate(detections_ai):
-                if not matched_ai[idx]:
-                    continue                         
-                verified_this_frame.append({
-                    "box": (det["left"], det["top"], det["right"], det["bottom"]),
-                    "label": det["label"],
-                    "conf": det["confidence"],
-                    "ttl": 2,
-                    "shape_id": idx,                
-                })
-
-            next_buf = []
-            for e in self.yolo_verified_buffer:
-                e["ttl"] -= 1
-                if e["ttl"] > 0:
-                    next_buf.append(e)
-            self.yolo_verified_buffer = next_buf
-
-            for v in verified_this_frame:
-                hit = next((e for e in self.yolo_verified_buffer
-                            if self.compute_iou(e["box"], v["box"]) > 0.2), None)
-                if hit:
-                    hit.update(box=v["box"], label=v["label"], conf=v["conf"], ttl=2)
-                else:
-                    self.yolo_verified_buffer.append(v)
-
-            for e in self.yolo_verified_buffer:
-                l, t, r, b = e["box"]
-                cv2.rectangle(overlay_with_yolo, (l, t), (r, b), (0, 255, 0), 2)
-                cv2.putText(
-                    overlay_with_yolo,
-                    f'{e["label"]} {e["conf"]:.2f}',
-                    (l, t - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
-                )
+                yolo_box = (det["left"] + dx, det["top"] + dy, det["right"] + dx, det["bottom"] + dy)
+                iou = self.compute_iou(shape_box, yolo_box)
+                if iou > best_iou:
+                    best_iou, best_idx, best_box = iou, idx, yolo_box
+
+            if best_iou > 0.15:
+                matched_ai[best_idx] = True
+                matched_box[best_idx] = best_box
+                d["ai_valid"] = True
+            else:
+                d["ai_valid"] = False
+
+        for idx, det in enumerate(detections_ai):
+            if not matched_ai[idx]:
+                continue
+            verified_this_frame.append({
+                "box": matched_box[idx],
+                "label": det["label"],
+                "conf": det["confidence"],
+                "ttl": 2,
+                "shape_id": idx,
+            })
+
+        next_buf = []
+        for e in self.yolo_verified_buffer:
+            e["ttl"] -= 1
+            if e["ttl"] > 0:
+                next_buf.append(e)
+        self.yolo_verified_buffer = next_buf
+
+        for v in verified_this_frame:
+            hit = next((e for e in self.yolo_verified_buffer
+                        if self.compute_iou(e["box"], v["box"]) > 0.2), None)
+            if hit:
+                hit.update(box=v["box"], label=v["label"], conf=v["conf"], ttl=2)
+            else:
+                self.yolo_verified_buffer.append(v)
 
+        for e in self.yolo_verified_buffer:
+            l, t, r, b = e["box"]
+            cv2.rectangle(overlay_with_yolo, (l, t), (r, b), (0, 255, 0), 2)
+            cv2.putText(
+                overlay_with_yolo,
+                f'{e["label"]} {e["conf"]:.2f}',
+                (l, t - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
+            )
+        pkt.overlay_with_yolo = overlay_with_yolo
 
-            # 6. Track everything
-            if MODE in ("sortify", "demo"):
-                dets_by_type: Dict[Tuple[str, str], List[DetectionData]] = {}
-                for obj in detections_post:
-                    dets_by_type.setdefault((obj["shape"], obj["color"]), []).append(obj["data"])
+    def get_yolo_detections(self, pkt: FramePacket) -> Tuple[List[dict], int]:
+        """
+        YOLO boxes for this frame and how many frames old they are.
+        In async mode the newest finished result is used; results older than
+        YOLO_MAX_LAG_FRAMES are dropped.
+        """
+        if not ENABLE_YOLO:
+            return [], 0
+        if pkt.static:
+            return self.last_yolo_dets, 0
+
+        # YOLO only sees the workspace; boxes are shifted back to frame coordinates
+        frame, ox, oy = pkt.base_image, 0, 0
+        if self.workspace is not None:
+            ox, oy, x1, y1 = self.workspace.union
+            frame = frame[oy:y1, ox:x1]
+
+        if self.yolo_worker is None:
+            self.last_yolo_dets = self.offset_boxes(run_yolo_inference(frame), ox, oy)
+            return self.last_yolo_dets, 0
+
+        self.yolo_worker.submit(pkt.frame_id, frame)
+        src_frame, detections_ai = self.yolo_worker.latest()
+        lag = pkt.frame_id - src_frame
+        if src_frame < 0 or lag > YOLO_MAX_LAG_FRAMES:
+            return [], 0
+        self.last_yolo_dets = self.offset_boxes(detections_ai, ox, oy)
+        return self.last_yolo_dets, lag
+
+    @staticmethod
+    def offset_boxes(dets: List[dict], ox: int, oy: int) -> List[dict]:
+        if not (ox or oy):
+            return dets
+        return [{**d, "left": d["left"] + ox, "top": d["top"] + oy,
+                 "right": d["right"] + ox, "bottom": d["bottom"] + oy} for d in dets]
+
+    def checkpoint_tracker(self, force: bool = False) -> None:
+        """Queue a tracker checkpoint every TRACK_CHECKPOINT_INTERVAL_S seconds (or now if *force*)."""
+        now = time.time()
+        if not TRACK_CHECKPOINT_PATH or not (force or now - self.last_checkpoint >= TRACK_CHECKPOINT_INTERVAL_S):
+            return
+        self.last_checkpoint = now
+        self.checkpoint_writer.submit(self.tracker.checkpoint_state())
+
+    def track_stage(self, pkt: FramePacket) -> None:
+        params = pkt.params
+        detections_post = pkt.detections
+        tracked: List[TrackedOutput] = []
+
+        # 6. Track everything
+        if MODE in ("sortify", "demo"):
+            dets_by_type: Dict[Tuple[str, str], List[DetectionData]] = {}
+            for obj in detections_post:
+                dets_by_type.setdefault((obj["shape"], obj["color"]), []).append(obj["data"])
 
-                all_tracked: List[TrackedOutput] = []
-                for (shape, color), det_list in dets_by_type.items():
-                    tracker = self.trackers.setdefault((shape, color), ShapeTracker())
-                    for t in tracker.track(shape, color, det_list, params):
+            all_tracked: List[TrackedOutput] = []
+            with self.watchdog.deadline("track"):
+                for (shape, color), outs in self.tracker.track_all(dets_by_type, params, timestamp=pkt.timestamp).items():
+                    for t in outs:
                         t["tracker_valid"] = True
                         all_tracked.append({"shape": shape, "color": color, "data": t})
 
-                # 7. Scoring
-                tracked: List[TrackedOutput] = []
-                for det in all_tracked:
+            snap = self.tracker.snapshot(pkt.frame_id)
+            with self.track_cond:
+                self.track_snapshot = snap
+                self.track_cond.notify_all()
+            self.checkpoint_tracker()
+
+            # 7. Scoring
+            for det in all_tracked:
+                d = det["data"]
+                decision = DecisionResult.get_decision(d, params)
+                d["score"] = getattr(decision, "score", None)
+                d["accepted"] = decision.accepted
+                if decision.accepted:
+                    shape, color = det["shape"], det["color"]
+                    if (shape, color) in GROUND_TRUTH_POS:
+                        gx, gy, gz = GROUND_TRUTH_POS[(shape, color)]
+                        d["pos_err_mm"] = math.dist((d["x_mm"], d["y_mm"], d["z_mm"]), (gx, gy, gz))
+                    else:
+                        d["pos_err_mm"] = None
+                    tracked.append(det)
+
+        # 6–7. Stateless passthrough
+        elif MODE == "safety":
+            for obj in detections_post:
+                d = obj["data"]
+                d["accepted"] = True
+                d["score"] = 999  # dummy
+                d["tracker_valid"] = False
+                tracked.append(obj)
+
+        # 8. Publish (all tracks of the frame go to the robot frame in one transform)
+        if MODE == "sortify":
+            pub = [det for det in tracked if all(k in det["data"] for k in ("x_mm", "y_mm", "z_mm"))]
+            if pub:
+                cam = np.array([[det["data"][k] for k in ("x_mm", "y_mm", "z_mm")] for det in pub], dtype=np.float64)
+                for det, xyz in zip(pub, EXTRINSICS.to_robot(cam)):
                     d = det["data"]
-                    decision = DecisionResult.get_decision(d)
-                    d["score"] = getattr(decision, "score", None)
-                    d["accepted"] = decision.accepted
-                    if decision.accepted:
-                        shape, color = det["shape"], det["color"]
-                        if (shape, color) in GROUND_TRUTH_POS:
-                            gx, gy, gz = GROUND_TRUTH_POS[(shape, color)]
-                            d["pos_err_mm"] = math.dist((d["x_mm"], d["y_mm"], d["z_mm"]), (gx, gy, gz))
-                        else:
-                            d["pos_err_mm"] = None
-                        tracked.append(det)
-
-            # 6–7. Stateless passthrough
-            elif MODE == "safety":
-                tracked: List[TrackedOutput] = []
-                for obj in detections_post:
-                    d = obj["data"]
-                    d["accepted"] = True
-                    d["score"] = 999  # dummy
-                    d["tracker_valid"] = False
-                    tracked.append(obj)
-
-            # 8. Publish
+                    self.send_output(det["shape"], det["color"], d, accepted=d["accepted"], robot_xyz=xyz)
+
+        pkt.tracked = tracked
+
+    def render_stage(self, pkt: FramePacket) -> bool:
+        """
+        Draws overlays, logs KPIs and shows the debug view. Returns True to stop.
+        """
+        params = pkt.params
+        tracked = pkt.tracked
+
+        # 9. Visualization
+        overlay = self.pool.copy(pkt.base_image)
+        pkt.buffers.append(overlay)
+        if DRAW_DETECTIONS:
+            draw_detections(overlay, tracked)
+        if DRAW_SCORING:
+            draw_scoring_overlay(overlay, tracked)
+
+        self.fps_count += 1
+        if (now := time.time()) - self.fps_timer >= 1:
+            self.fps_avg = self.fps_count / (now - self.fps_timer)
+            self.fps_timer, self.fps_count = now, 0
+            if console_logger.isEnabledFor(logging.DEBUG):
+                self.log_stats()
+        cv2.putText(overlay, f"{self.fps_avg:.1f} FPS", (10, 32), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (100, 255, 200), 2)
+
+        h, w = overlay.shape[:2]
+        if DEBUG_LAYOUT == "2x2":
+            debug_img = self.pool.acquire((2 * h, 2 * w, 3))
+            build_debug_view(
+                pkt.masks.raw("red"),
+                pkt.masks.raw("blue"),
+                pkt.overlay_with_yolo,
+                overlay,
+                out=debug_img,
+            )
+        else:
+            debug_img = self.pool.acquire((2 * h, w, 3))
+            np.concatenate([pkt.overlay_with_yolo, overlay], axis=0, out=debug_img)
+        pkt.buffers.append(debug_img)
+        self.frame_allocs = self.pool.frame_allocations()
+
+        # 10. Logging
+        if self.kpi_logger and self.logging_start_frame is not None:
+            rel = pkt.frame_id - self.logging_start_frame
+            if rel < LOGGING_MAX_FRAMES_DEFAULT:
+                self.kpi_logger.update(frame_rel=rel, detections=[
+                    {**det["data"], "shape": det["shape"], "color": det["color"]} for det in tracked
+                ], fps_avg=self.fps_avg, overlay=overlay)
+            else:
+                self.kpi_logger.close()
+                self.kpi_logger = self.logging_start_frame = None
+                console_logger.info("Logging STOPPED")
+
+        # 11. Show/debug/log
+        if USE_GUI:
             if MODE == "sortify":
-                for det in tracked:
-                    d = det["data"]
-                    if not all(k in d for k in ("x_mm", "y_mm", "z_mm")):
-                        continue
-                    self.send_output(det["shape"], det["color"], d, accepted=d["accepted"])
-
-            # 9. Visualization
-            overlay = base_image.copy()
-            if DRAW_DETECTIONS:
-                draw_detections(overlay, tracked)
-            if DRAW_SCORING:
-                draw_scoring_overlay(overlay, tracked)
-
-
-            fps_count += 1
-            if (now := time.time()) - fps_timer >= 1:
-                fps_avg = fps_count / (now - fps_timer)
-                fps_timer, fps_count = now, 0
-            cv2.putText(overlay, f"{fps_avg:.1f} FPS", (10, 32), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (100, 255, 200), 2)
-
-            depth_norm = np.clip((depth_frame.astype(np.float32) - DEPTH_MIN_MM)
-                                * 255.0 / (DEPTH_MAX_MM - DEPTH_MIN_MM), 0, 255).astype(np.uint8)
-            depth_vis = cv2.applyColorMap(depth_norm, cv2.COLORMAP_JET)
-            hsv = cv2.cvtColor(processed, cv2.COLOR_BGR2HSV)
-            
-            debug_img = build_debug_view(
-                DetectColor.red(hsv, params),
-                DetectColor.blue(hsv, params),
-                overlay_with_yolo,
-                overlay
-            ) if DEBUG_LAYOUT == "2x2" else np.vstack([overlay_with_yolo, overlay])
-
-
-            # 10. Logging
-            if self.kpi_logger and self.logging_start_frame is not None:
-                rel = self.global_frame_counter - self.logging_start_frame
-                if rel < LOGGING_MAX_FRAMES_DEFAULT:
-                    self.kpi_logger.update(frame_rel=rel, detections=[
-                        {**det["data"], "shape": det["shape"], "color": det["color"]} for det in tracked
-                    ], fps_avg=fps_avg, overlay=overlay)
-                else:
-                    self.kpi_logger.close()
-                    self.kpi_logger = self.logging_start_frame = None
-                    console_logger.info("Logging STOPPED")
-
-            # 11. Show/debug/log
-            if USE_GUI:
-                if MODE == "sortify":
-                    foc = int(params.get("focus", 0))
-                    if foc != self._prev_focus:
-                        self.camera.set_focus(foc)
-                        self._prev_focus = foc
-                        
-                cv2.imshow("Debug View", debug_img)
-                if self.handle_key_press(cv2.waitKey(1) & 0xFF, base_image):
-                    break
+                foc = int(params.get("focus", 0))
+                if foc != self._prev_focus:
+                    self.camera.set_focus(foc)
+                    self._prev_focus = foc
+
+            cv2.imshow("Debug View", debug_img)
+            if self.handle_key_press(cv2.waitKey(1) & 0xFF, pkt.base_image):
+                return True
+        return False
 
+    def shutdown(self) -> None:
+        self.watchdog.stop()
+        if self.pipeline is not None:
+            dropped = self.pipeline.dropped()
+            console_logger.info(f"Pipeline dropped {sum(dropped.values())} frame(s) before stages: {dropped}")
+        if MODE in ("sortify", "demo"):
+            self.checkpoint_tracker(force=True)
+            self.checkpoint_writer.stop()
+        if self.yolo_worker is not None:
+            self.yolo_worker.stop()
         cv2.destroyAllWindows()
         if MODE == "sortify" and hasattr(self, "ros"):
             self.ros.destroy()
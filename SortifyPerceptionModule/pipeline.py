@@ -0,0 +1,262 @@
+"""
+pipeline.py
+
+Threaded frame pipeline for the perception loop.
+Each stage runs on its own thread and hands frames to the next one through
+bounded queues, so frame rate follows the slowest stage instead of the sum of all stages.
+"""
+
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class EndOfInput(RuntimeError):
+    """
+    Raised by a pipeline source when it has no more frames. Frames already
+    in the pipeline are still finished before it propagates.
+    """
+
+
+@dataclass
+class FramePacket:
+    """
+    Everything one frame carries from capture to rendering.
+    """
+    frame_id: int
+    color: np.ndarray
+    depth: np.ndarray
+    params: Dict[str, Any]
+    timestamp: Optional[float] = None       # capture time in seconds, drives the tracker's time step
+    base_image: Optional[np.ndarray] = None
+    processed: Optional[np.ndarray] = None
+    masks: Any = None                       # detection.MaskCache of the processed frame
+    detections: List[dict] = field(default_factory=list)
+    overlay_with_yolo: Optional[np.ndarray] = None
+    tracked: List[dict] = field(default_factory=list)
+    static: bool = False                    # motion gate saw no change; detections are carried over
+    buffers: List[np.ndarray] = field(default_factory=list)   # FramePool buffers owned by this frame
+
+
+class FramePool:
+    """
+    Recycles fixed-size image buffers across frames.
+    acquire() hands out a free buffer of the requested shape and dtype and only
+    allocates when none is free; release() returns it. Thread-safe.
+    Allocation counters show whether the loop has reached steady state.
+    """
+    def __init__(self) -> None:
+        self._free: Dict[Tuple[Tuple[int, ...], str], List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.in_use = 0
+        self._marked = 0
+
+    def acquire(self, shape: Tuple[int, ...], dtype: Any = np.uint8) -> np.ndarray:
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            self.in_use += 1
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+            self.allocations += 1
+        return np.empty(shape, dtype=dtype)
+
+    def copy(self, src: np.ndarray) -> np.ndarray:
+        """
+        Pooled copy of *src*.
+        """
+        buf = self.acquire(src.shape, src.dtype)
+        np.copyto(buf, src)
+        return buf
+
+    def release(self, buf: np.ndarray) -> None:
+        with self._lock:
+            self.in_use -= 1
+            self._free.setdefault((buf.shape, buf.dtype.str), []).append(buf)
+
+    def release_packet(self, pkt: FramePacket) -> None:
+        """
+        Return every buffer a frame owns.
+        """
+        for buf in pkt.buffers:
+            self.release(buf)
+        pkt.buffers = []
+
+    def frame_allocations(self) -> int:
+        """
+        Allocations since the previous call; call once per frame.
+        """
+        with self._lock:
+            n, self._marked = self.allocations - self._marked, self.allocations
+        return n
+
+
+class StageQueue:
+    """
+    Bounded FIFO between two stages.
+    When full, either drops the oldest frame (keeps latency low) or blocks the producer.
+    *on_drop* is called with every item that is dropped or discarded on close.
+    After finish() the consumer still gets the queued items, then None.
+    """
+    def __init__(self, maxsize: int = 2, drop_oldest: bool = True,
+                 on_drop: Optional[Callable[[Any], None]] = None) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.drop_oldest = drop_oldest
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.closed = False
+        self.finished = False
+        self._items: Deque[Any] = deque()
+        self._cond = threading.Condition()
+
+    def put(self, item: Any) -> None:
+        with self._cond:
+            while len(self._items) >= self.maxsize and not self.closed:
+                if self.drop_oldest:
+                    self._discard(self._items.popleft())
+                    self.dropped += 1
+                else:
+                    self._cond.wait(0.1)
+            if self.closed:
+                self._discard(item)
+                return
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def get(self) -> Optional[Any]:
+        """
+        Block until an item is available. Returns None once the queue is
+        closed, or finished and empty.
+        """
+        with self._cond:
+            while not self._items and not self.closed and not self.finished:
+                self._cond.wait(0.1)
+            if self.closed or not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def finish(self) -> None:
+        """
+        No more items will be put; the queued ones are still delivered.
+        """
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            while self._items:
+                self._discard(self._items.popleft())
+            self._cond.notify_all()
+
+    def _discard(self, item: Any) -> None:
+        if self.on_drop is not None and item is not None:
+            self.on_drop(item)
+
+
+class FramePipeline:
+    """
+    Runs source → stages → sink, one thread per stage.
+    The sink runs on the calling thread (OpenCV windows must live on the main thread)
+    and stops the pipeline by returning True. Frames pass every stage in capture order,
+    but stages overlap: a stage that needs a later stage's result for the previous
+    frame waits for it itself.
+    When the source raises EndOfInput the queued frames are drained through every
+    stage and the sink, then run() raises it.
+    *discard* is called for frames dropped between stages, e.g. to recycle their buffers.
+    """
+    def __init__(
+        self,
+        source: Callable[[], Any],
+        stages: List[Tuple[str, Callable[[Any], None]]],
+        sink: Callable[[Any], bool],
+        queue_size: int = 2,
+        drop_oldest: bool = True,
+        discard: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        self.source = source
+        self.stages = stages
+        self.sink = sink
+        self.queues = [StageQueue(queue_size, drop_oldest, discard) for _ in range(len(stages) + 1)]
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._end: Optional[EndOfInput] = None
+
+    def dropped(self) -> Dict[str, int]:
+        """
+        Frames dropped in front of each stage.
+        """
+        names = [name for name, _ in self.stages] + ["render"]
+        return {name: q.dropped for name, q in zip(names, self.queues)}
+
+    def stopping(self) -> bool:
+        """
+        True once the pipeline is shutting down, for stages that wait on each other.
+        """
+        return self._stop.is_set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        for q in self.queues:
+            q.close()
+
+    def run(self) -> None:
+        threads = [threading.Thread(target=self._run_source, name="capture", daemon=True)]
+        for i, (name, fn) in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._run_stage, args=(fn, self.queues[i], self.queues[i + 1]),
+                name=name, daemon=True,
+            ))
+        for t in threads:
+            t.start()
+
+        try:
+            while not self._stop.is_set():
+                item = self.queues[-1].get()
+                if item is None:
+                    break
+                if self.sink(item):
+                    break
+        finally:
+            self.stop()
+            for t in threads:
+                t.join(timeout=2.0)
+
+        if self._error is not None:
+            raise self._error
+        if self._end is not None:
+            raise self._end
+
+    def _fail(self, exc: BaseException) -> None:
+        if self._error is None:
+            self._error = exc
+        self.stop()
+
+    def _run_source(self) -> None:
+        try:
+            while not self._stop.is_set():
+                self.queues[0].put(self.source())
+        except EndOfInput as e:
+            self._end = e
+            self.queues[0].finish()
+        except BaseException as e:
+            self._fail(e)
+
+    def _run_stage(self, fn: Callable[[Any], None], q_in: StageQueue, q_out: StageQueue) -> None:
+        try:
+            while not self._stop.is_set():
+                item = q_in.get()
+                if item is None:
+                    q_out.finish()
+                    break
+                fn(item)
+                q_out.put(item)
+        except BaseException as e:
+            self._fail(e)
@@ -7,7 +7,7 @@ Includes camera-to-robot frame transformation and depth validation.
 
 
 from config import CAMERA_LEFT_MM, CAMERA_ABOVE_BASE_MM
-from typing import Tuple, Optional, Dict
+from typing import Tuple, Optional, Dict, List
 import cv2
 import numpy as np
 
@@ -20,8 +20,12 @@ from config import (
     DEPTH_MIN_MM,
     DEPTH_MAX_MM,
     DEPTH_OFFSET_MM,
+    DEPTH_MAD_K,
+    DEPTH_MIN_INLIERS,
+    CAMERA_WIDTH,
+    CAMERA_HEIGHT,
     CAMERA_LEFT_MM,
-    CAMERA_FORAWRD_MM,
+    CAMERA_FORWARD_MM,
     CAMERA_ABOVE_BASE_MM,
     TILT_DEGREES,
 )
@@ -35,6 +39,149 @@ def get_rotation_matrix_x(degrees: float) -> np.ndarray:
         [0, math.sin(angle),  math.cos(angle)]
     ])
 
+def hist_median(bins: np.ndarray, counts: np.ndarray) -> float:
+    """
+    Median of values given as a histogram (same result as np.median on the expanded values).
+    """
+    n = int(counts.sum())
+    cum = np.cumsum(counts)
+    lo = bins[np.searchsorted(cum, (n - 1) // 2 + 1)]
+    hi = bins[np.searchsorted(cum, n // 2 + 1)]
+    return (float(lo) + float(hi)) / 2.0
+
+
+def robust_depth(depth_vals: np.ndarray, k: float = DEPTH_MAD_K) -> Tuple[float, int]:
+    """
+    Median depth after dropping values more than k · 1.4826 · MAD from the median.
+    Returns (depth, inlier count). Integer depths (the DEPTH_MIN_MM..DEPTH_MAX_MM
+    range) are counted in a histogram, so no sorting is needed.
+    """
+    if depth_vals.size == 0:
+        return 0.0, 0
+    if not np.issubdtype(depth_vals.dtype, np.integer):
+        med = float(np.median(depth_vals))
+        dev = np.abs(depth_vals - med)
+        mad = float(np.median(dev)) or 1.0
+        inliers = depth_vals[dev <= k * 1.4826 * mad]
+        return float(np.median(inliers)), int(inliers.size)
+
+    lo = int(depth_vals.min())
+    counts = np.bincount((depth_vals - lo).astype(np.intp))
+    bins = np.arange(lo, lo + counts.size)
+    med = hist_median(bins, counts)
+
+    # MAD: weighted median of each bin's distance to the median
+    dev = np.abs(bins - med)
+    order = np.argsort(dev, kind="stable")
+    mad = hist_median(dev[order], counts[order]) or 1.0
+
+    keep = counts * (dev <= k * 1.4826 * mad)
+    n_in = int(keep.sum())
+    if n_in == 0:
+        return med, 0
+    return hist_median(bins, keep), n_in
+
+
+class CameraExtrinsics:
+    """
+    Camera→robot transform as one 4×4 homogeneous matrix, built once from the
+    mounting config: tilt about the camera x-axis, flip z (robot z points up),
+    then the camera offset.
+    """
+    def __init__(
+        self,
+        tilt_deg: float = TILT_DEGREES,
+        left_mm: float = CAMERA_LEFT_MM,
+        forward_mm: float = CAMERA_FORWARD_MM,
+        above_mm: float = CAMERA_ABOVE_BASE_MM,
+    ) -> None:
+        T = np.eye(4)
+        T[:3, :3] = np.diag([1.0, 1.0, -1.0]) @ get_rotation_matrix_x(tilt_deg)
+        T[:3, 3] = (left_mm, forward_mm, above_mm)
+        self.T = T
+        # Rigid transform: inverse rotation is the transpose
+        T_inv = np.eye(4)
+        T_inv[:3, :3] = T[:3, :3].T
+        T_inv[:3, 3] = -T[:3, :3].T @ T[:3, 3]
+        self.T_inv = T_inv
+
+    @staticmethod
+    def _apply(T: np.ndarray, pts: np.ndarray) -> np.ndarray:
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 3)
+        return pts @ T[:3, :3].T + T[:3, 3]
+
+    def to_robot(self, pts_cam: np.ndarray) -> np.ndarray:
+        """
+        (N, 3) camera points in mm → (N, 3) robot points in mm.
+        """
+        return self._apply(self.T, pts_cam)
+
+    def to_camera(self, pts_robot: np.ndarray) -> np.ndarray:
+        """
+        (N, 3) robot points in mm → (N, 3) camera points in mm.
+        """
+        return self._apply(self.T_inv, pts_robot)
+
+    def project(self, pts_robot: np.ndarray, fx: float, fy: float, cx0: float, cy0: float) -> np.ndarray:
+        """
+        Pixel (u, v) of robot-frame points, (N, 2). NaN for points behind the camera.
+        """
+        cam = self.to_camera(pts_robot)
+        z = cam[:, 2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            uv = np.stack([cam[:, 0] * fx / z + cx0, cam[:, 1] * fy / z + cy0], axis=1)
+        uv[z <= 0] = np.nan
+        return uv
+
+
+class RayTable:
+    """
+    Per-pixel ray lookup: for every pixel the undistorted normalized ray
+    (x/z, y/z), built once from the calibration with cv2.undistortPoints.
+    Back-projection is then a table lookup times depth.
+    """
+    def __init__(
+        self,
+        fx: float,
+        fy: float,
+        cx0: float,
+        cy0: float,
+        dist: Optional[List[float]] = None,
+        width: int = CAMERA_WIDTH,
+        height: int = CAMERA_HEIGHT,
+    ) -> None:
+        K = np.array([[fx, 0.0, cx0], [0.0, fy, cy0], [0.0, 0.0, 1.0]])
+        dist_arr = np.zeros(5) if dist is None else np.asarray(dist, dtype=np.float64)
+        u, v = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+        px = np.stack([u.ravel(), v.ravel()], axis=1).reshape(-1, 1, 2)
+        criteria = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 20, 1e-9)
+        rays = cv2.undistortPointsIter(px, K, dist_arr, None, None, criteria)
+        self.rays = rays.reshape(height, width, 2)
+
+    def lookup(self, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        """
+        Rays at sub-pixel positions (bilinear, clamped to the table), (N, 2).
+        """
+        h, w = self.rays.shape[:2]
+        u = np.clip(np.asarray(u, dtype=np.float64).ravel(), 0, w - 1)
+        v = np.clip(np.asarray(v, dtype=np.float64).ravel(), 0, h - 1)
+        x0 = np.minimum(u.astype(np.intp), max(w - 2, 0))
+        y0 = np.minimum(v.astype(np.intp), max(h - 2, 0))
+        x1, y1 = np.minimum(x0 + 1, w - 1), np.minimum(y0 + 1, h - 1)
+        ax, ay = (u - x0)[:, None], (v - y0)[:, None]
+        top = self.rays[y0, x0] * (1 - ax) + self.rays[y0, x1] * ax
+        bottom = self.rays[y1, x0] * (1 - ax) + self.rays[y1, x1] * ax
+        return top * (1 - ay) + bottom * ay
+
+    def back_project(self, u: np.ndarray, v: np.ndarray, z: np.ndarray) -> np.ndarray:
+        """
+        Camera-space points (N, 3) in mm for pixels (u, v) at depth z.
+        """
+        z = np.asarray(z, dtype=np.float64).ravel()
+        xy = self.lookup(u, v) * z[:, None]
+        return np.column_stack([xy, z])
+
+
 class PositionEstimator:
     @staticmethod
     def to_3d(
@@ -51,31 +198,28 @@ class PositionEstimator:
     def transform_camera_to_robot(x_mm: float, y_mm: float, z_mm: float) -> Tuple[float, float, float]:
         """
         Convert 3D point from camera coordinates to robot coordinates.
+        For many points use EXTRINSICS.to_robot on an (N, 3) array.
         """
-        # Tilt correction (rotate point around x-axis)
-        point = np.array([[x_mm], [y_mm], [z_mm]])
-        R = get_rotation_matrix_x(TILT_DEGREES)
-        point_rotated = R @ point
-
-        # Apply camera offset relative to robot
-        x_r = point_rotated[0, 0] + CAMERA_LEFT_MM
-        y_r = point_rotated[1, 0] + CAMERA_FORWARD_MM
-        z_r = CAMERA_ABOVE_BASE_MM - point_rotated[2, 0]
-
-        return x_r, y_r, z_r
+        x_r, y_r, z_r = EXTRINSICS.to_robot(np.array([x_mm, y_mm, z_mm]))[0]
+        return float(x_r), float(y_r), float(z_r)
 
 
     @staticmethod
     def mask_overlap(mask: np.ndarray, cx: int, cy: int, r: int) -> float:
         """
         Calculate the overlap between a circular mask and a region of interest in the mask.
+        Works on the circle's bounding patch only.
         """        
         if r <= 0:
             return 0.0
         h, w = mask.shape[:2]
-        circ = np.zeros((h, w), dtype=np.uint8)
-        cv2.circle(circ, (cx, cy), r, 255, -1)
-        overlap = cv2.bitwise_and(mask, circ)
+        x0, y0 = max(0, cx - r), max(0, cy - r)
+        x1, y1 = min(cx + r + 1, w), min(cy + r + 1, h)
+        if x0 >= x1 or y0 >= y1:
+            return 0.0
+        circ = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.circle(circ, (int(cx - x0), int(cy - y0)), int(r), 255, -1)
+        overlap = cv2.bitwise_and(mask[y0:y1, x0:x1], circ)
         area_circ = cv2.countNonZero(circ)
         area_inter = cv2.countNonZero(overlap)
         return (area_inter / area_circ) if area_circ else 0.0
@@ -89,55 +233,97 @@ class PositionEstimator:
         cx0: float,
         cy0: float,
         mask: Optional[np.ndarray] = None,
+        rays: Optional[RayTable] = None,
     ) -> Dict:
         """
         Estimate the 3D position of an object based on its 2D coordinates and the depth map.
         Also checks for depth validity and mask overlap.
         """        
+        return PositionEstimator.estimate_positions([det], depth_map, fx, fy, cx0, cy0, [mask], rays)[0]
 
-        if not det or any(k not in det for k in ("cx", "cy", "r")):
-            return PositionEstimator.empty_result()
-
-        cx, cy, r = map(int, map(round, (det["cx"], det["cy"], det["r"])))
+    @staticmethod
+    def estimate_positions(
+        dets: List[Dict],
+        depth_map: np.ndarray,
+        fx: float,
+        fy: float,
+        cx0: float,
+        cy0: float,
+        masks: Optional[List[Optional[np.ndarray]]] = None,
+        rays: Optional[RayTable] = None,
+    ) -> List[Dict]:
+        """
+        estimate_position() for all detections of a frame.
+        The depth range check runs once per frame; everything else only inside
+        each detection's bounding box, so cost follows object area.
+        With a RayTable the centroids are back-projected through the lens model
+        in one lookup at the end; without one, plain pinhole.
+        """
         h, w = depth_map.shape
-        if not (0 <= cx < w and 0 <= cy < h) or r <= 3:
-            return PositionEstimator.empty_result()
+        masks = masks if masks is not None else [None] * len(dets)
+        valid_depth = None
+        out = []
+        uvz = []
+        for det, mask in zip(dets, masks):
+            if not det or any(k not in det for k in ("cx", "cy", "r")):
+                out.append(PositionEstimator.empty_result())
+                continue
+            cx, cy, r = map(int, map(round, (det["cx"], det["cy"], det["r"])))
+            if not (0 <= cx < w and 0 <= cy < h) or r <= 3:
+                out.append(PositionEstimator.empty_result())
+                continue
+            if valid_depth is None:
+                valid_depth = (depth_map >= DEPTH_MIN_MM) & (depth_map <= DEPTH_MAX_MM)
 
-        roi = np.zeros_like(depth_map, dtype=np.uint8)
-        cv2.circle(roi, (cx, cy), r, 255, -1)
-        if mask is not None:
-            roi = cv2.bitwise_and(roi, mask.astype(np.uint8))
+            # Object disc on its bounding patch, cut by the color mask
+            x0, y0 = max(0, cx - r), max(0, cy - r)
+            x1, y1 = min(cx + r + 1, w), min(cy + r + 1, h)
+            circ = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+            cv2.circle(circ, (cx - x0, cy - y0), r, 255, -1)
+            roi = circ if mask is None else cv2.bitwise_and(circ, mask[y0:y1, x0:x1].astype(np.uint8))
 
-        valid_depth = (depth_map >= DEPTH_MIN_MM) & (depth_map <= DEPTH_MAX_MM)
-        depth_vals = depth_map[(roi > 0) & valid_depth]
-        if depth_vals.size < 20:
-            return PositionEstimator.empty_result()
+            depth_vals = depth_map[y0:y1, x0:x1][(roi > 0) & valid_depth[y0:y1, x0:x1]]
+            if depth_vals.size < 20:
+                out.append(PositionEstimator.empty_result())
+                continue
+            z_mm, inliers = robust_depth(depth_vals)
+            if inliers < DEPTH_MIN_INLIERS:
+                out.append(PositionEstimator.empty_result())
+                continue
+            z_mm += DEPTH_OFFSET_MM
 
-        med = float(np.median(depth_vals))
-        mad = float(np.median(np.abs(depth_vals - med))) or 1.0
-
-        if depth_vals.size < 15:
-            return PositionEstimator.empty_result()
-
-        z_mm = float(np.median(depth_vals)) + DEPTH_OFFSET_MM
+            # Centroid in frame coordinates: shifting the patch moments keeps the sums exact
+            m = cv2.moments(roi, binaryImage=True)
+            m00 = m["m00"]
+            if m00 == 0:
+                out.append(PositionEstimator.empty_result())
+                continue
+            u = (m["m10"] + x0 * m00) / m00
+            v = (m["m01"] + y0 * m00) / m00
 
-        m = cv2.moments(roi, binaryImage=True)
-        if m["m00"] == 0:
-            return PositionEstimator.empty_result()
-        u = m["m10"] / m["m00"]
-        v = m["m01"] / m["m00"]
+            if rays is None:
+                x_mm, y_mm, z_mm = PositionEstimator.to_3d(u, v, z_mm, fx, fy, cx0, cy0)
+            else:
+                x_mm = y_mm = 0.0
+                uvz.append((len(out), u, v, z_mm))
 
-        x_mm, y_mm, z_mm = PositionEstimator.to_3d(u, v, z_mm, fx, fy, cx0, cy0)
+            area_circ = cv2.countNonZero(circ)
+            overlap = cv2.countNonZero(roi) / area_circ if area_circ else 0.0
 
-        overlap = PositionEstimator.mask_overlap(mask if mask is not None else roi, cx, cy, r)
+            out.append({
+                "x_mm": x_mm,
+                "y_mm": y_mm,
+                "z_mm": z_mm,
+                "depth_valid": DEPTH_MIN_MM <= z_mm <= DEPTH_MAX_MM,
+                "depth_mask_valid": overlap >= MASK_OVERLAP_OK,
+                "depth_inliers": inliers,
+            })
 
-        return {
-            "x_mm": x_mm,
-            "y_mm": y_mm,
-            "z_mm": z_mm,
-            "depth_valid": DEPTH_MIN_MM <= z_mm <= DEPTH_MAX_MM,
-            "depth_mask_valid": overlap >= MASK_OVERLAP_OK,
-        }
+        if uvz:
+            idx, us, vs, zs = zip(*uvz)
+            for i, (x_mm, y_mm, _) in zip(idx, rays.back_project(us, vs, zs)):
+                out[i]["x_mm"], out[i]["y_mm"] = float(x_mm), float(y_mm)
+        return out
 
     @staticmethod
     def empty_result() -> Dict:
@@ -150,10 +336,14 @@ class PositionEstimator:
             "z_mm": 0.0,
             "depth_valid": False,
             "depth_mask_valid": False,
+            "depth_inliers": 0,
         }
 
+EXTRINSICS = CameraExtrinsics()
+
 # Shortcuts
 estimate_position = PositionEstimator.estimate_position
+estimate_positions = PositionEstimator.estimate_positions
 to_3d             = PositionEstimator.to_3d
 mask_overlap      = PositionEstimator.mask_overlap
 transform_camera_to_robot = PositionEstimator.transform_camera_to_robot
@@ -5,6 +5,8 @@ Handles image preprocessing before detection.
 Includes CLAHE (contrast), blurring, gray, and mask cleaning.
 """
 
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 import cv2
 import numpy as np
 from config import SLIDER_CONFIG
@@ -71,3 +73,155 @@ def clean_mask(mask: np.ndarray, params: dict) -> np.ndarray:
     cleaned = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=open_iter)
     cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_CLOSE, kernel, iterations=close_iter)
     return cleaned
+
+
+class PreprocessPipeline:
+    """
+    Compiled version of preprocess() and clean_mask().
+    The active stages are built once from the sliders and rebuilt only when those
+    change. CLAHE objects and structuring elements are cached by parameter value,
+    and every stage writes into reused buffers. Outputs are bit-identical.
+
+    Results rotate through *ring_size* output buffers, so a result stays valid
+    until ring_size further frames have been processed.
+    """
+    def __init__(self, ring_size: int = 2) -> None:
+        self._ring: List[Optional[np.ndarray]] = [None] * max(1, int(ring_size))
+        self._ring_pos = 0
+        self._buffers: Dict[str, np.ndarray] = {}
+        self._clahe: Dict[Tuple[float, Tuple[int, int]], Any] = {}
+        self._kernels: Dict[int, np.ndarray] = {}
+        self._key: Optional[tuple] = None
+        self._stages: List[Tuple[Callable[[np.ndarray, np.ndarray], None], int]] = []
+        self._clahe_obj = None
+        self._blur_k = 0
+        self._tag = ""        # buffer-name suffix, so each ROI size keeps its own scratch buffers
+
+    def compile(self, params: dict) -> None:
+        """
+        Configure from the runtime sliders, as the controller calls preprocess().
+        """
+        clip = float(params["clahe_clip"])
+        self.configure(use_clahe=clip > 0, clahe_clip=clip, blur_k=int(params["gaussian_k"]))
+
+    def configure(self, use_clahe: bool = True, clahe_clip: float = 2.0, blur_k: int = 5,
+                  use_gray: bool = False, tile_grid_size: Tuple[int, int] = (8, 8)) -> None:
+        """
+        Same options as preprocess(); no-op if nothing changed.
+        """
+        key = (bool(use_clahe), float(clahe_clip), int(blur_k), bool(use_gray), tuple(tile_grid_size))
+        if key == self._key:
+            return
+        self._key = key
+        self._stages = []
+        if use_clahe:
+            ck = (float(clahe_clip), tuple(tile_grid_size))
+            if ck not in self._clahe:
+                self._clahe[ck] = cv2.createCLAHE(clipLimit=ck[0], tileGridSize=ck[1])
+            self._clahe_obj = self._clahe[ck]
+            self._stages.append((self._apply_clahe, 3))
+        if blur_k > 0:
+            self._blur_k = blur_k if blur_k % 2 == 1 else blur_k + 1
+            self._stages.append((self._apply_blur, 3))
+        if use_gray:
+            self._stages.append((self._apply_gray, 1))
+
+    def run(self, frame_bgr: np.ndarray) -> np.ndarray:
+        """
+        Preprocess one frame into the next ring buffer.
+        """
+        dst = self._next_slot(self.output_shape(frame_bgr))
+        self._run_into(frame_bgr, dst)
+        return dst
+
+    def run_rois(self, frame_bgr: np.ndarray, rois: List[Tuple[int, int, int, int]],
+                 outside: Optional[List[Optional[np.ndarray]]] = None) -> np.ndarray:
+        """
+        Preprocess only inside the (non-overlapping) *rois*; the rest of the
+        full-size output is zero. `outside[i]`, if set, blanks pixels of ROI i.
+        """
+        dst = self._next_slot(self.output_shape(frame_bgr))
+        dst.fill(0)
+        for i, (x0, y0, x1, y1) in enumerate(rois):
+            sub = dst[y0:y1, x0:x1]
+            self._tag = f"/{i}"
+            try:
+                self._run_into(frame_bgr[y0:y1, x0:x1], sub)
+            finally:
+                self._tag = ""
+            if outside is not None and outside[i] is not None:
+                sub[outside[i]] = 0
+        return dst
+
+    def output_shape(self, frame_bgr: np.ndarray) -> Tuple[int, ...]:
+        if self._stages and self._stages[-1][1] == 1:
+            return frame_bgr.shape[:2]
+        return frame_bgr.shape
+
+    def _run_into(self, src: np.ndarray, dst: np.ndarray) -> None:
+        if not self._stages:
+            np.copyto(dst, src)
+            return
+        h, w = src.shape[:2]
+        for i, (stage, channels) in enumerate(self._stages):
+            shape = (h, w, channels) if channels > 1 else (h, w)
+            out = dst if i == len(self._stages) - 1 else self.buffer(f"stage{i}", shape)
+            stage(src, out)
+            src = out
+
+    def kernel(self, kernel_size: int) -> np.ndarray:
+        """
+        Elliptical structuring element as clean_mask() builds it, cached by size.
+        """
+        k = max(1, int(kernel_size))
+        if k % 2 == 0:
+            k += 1
+        if k not in self._kernels:
+            self._kernels[k] = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (k, k))
+        return self._kernels[k]
+
+    def clean_mask(self, mask: np.ndarray, params: dict, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        clean_mask() with a cached kernel; the opened mask goes into a reused buffer.
+        """
+        kernel = self.kernel(int(params.get("kernel_size")))
+        opened = self.buffer("opened", mask.shape)
+        cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, dst=opened, iterations=int(params.get("open_iter", 1)))
+        if dst is None:
+            dst = np.empty_like(mask)
+        cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel, dst=dst, iterations=int(params.get("close_iter", 1)))
+        return dst
+
+    def buffer(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        name += self._tag
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buf
+
+    def _next_slot(self, shape: Tuple[int, ...]) -> np.ndarray:
+        buf = self._ring[self._ring_pos]
+        if buf is None or buf.shape != shape:
+            buf = self._ring[self._ring_pos] = np.empty(shape, dtype=np.uint8)
+        self._ring_pos = (self._ring_pos + 1) % len(self._ring)
+        return buf
+
+    def _apply_clahe(self, src: np.ndarray, dst: np.ndarray) -> None:
+        h, w = src.shape[:2]
+        lab = self.buffer("lab", (h, w, 3))
+        l = self.buffer("l", (h, w))
+        l_eq = self.buffer("l_eq", (h, w))
+        cv2.cvtColor(src, cv2.COLOR_BGR2LAB, dst=lab)
+        cv2.extractChannel(lab, 0, dst=l)
+        self._clahe_obj.apply(l, dst=l_eq)
+        cv2.insertChannel(l_eq, lab, 0)
+        cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=dst)
+
+    def _apply_blur(self, src: np.ndarray, dst: np.ndarray) -> None:
+        cv2.GaussianBlur(src, (self._blur_k, self._blur_k), 0, dst=dst)
+
+    def _apply_gray(self, src: np.ndarray, dst: np.ndarray) -> None:
+        if src.ndim == 2:
+            np.copyto(dst, src)
+        else:
+            cv2.cvtColor(src, cv2.COLOR_BGR2GRAY, dst=dst)
@@ -36,11 +36,12 @@ class DecisionResult:
         }
 
     @staticmethod
-    def get_decision(raw: Dict[str, Any]) -> "DecisionResult":
+    def get_decision(raw: Dict[str, Any], params: Dict[str, Any] = None) -> "DecisionResult":
         """
         Calculate the score for an object and make a decision to accept or reject.
+        Pass the frame's params off the GUI thread so no trackbar is read there.
         """
-        weights = DecisionResult.weights()
+        weights = DecisionResult.weights(params)
 
         # Construct the label for tracking
         label = f"{raw.get('color', 'unknown')}_{raw.get('shape', 'unknown')}"
@@ -91,6 +92,7 @@ def merge_detection_info(obj: Dict[str, Any], shape_data: Dict[str, Any], pos_da
         "z_mm": pos_data.get("z_mm", 0.0),
         "depth_valid": pos_data.get("depth_valid", False),
         "depth_mask_valid": pos_data.get("depth_mask_valid", False),
+        "depth_inliers": pos_data.get("depth_inliers", 0),
         "color_valid": obj.get("color") is not None,
         "shape_valid": obj.get("shape") is not None,
         "color": obj.get("color", "unknown"),
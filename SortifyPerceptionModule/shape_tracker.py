@@ -1,91 +1,612 @@
 """
-shape_tracker.py  –  full drop‑in replacement
--------------------------------------------------
-2D/3D Kalman‑based multi‑object tracker with stricter life‑cycle rules.
-Changes vs. original:
-• stable_age filter is enforced when tracks are returned
-• stable_age reset whenever a frame is missed (track.lost++)
-• adaptive matching radius no longer grows without bound (lost bonus capped)
-• max_lost clamped to a sane 1‒60 range
-Everything else untouched.
+shape_tracker.py
+
+2D/3D Kalman multi-object tracker for all (shape, color) classes.
+Track state is kept in flat arrays: counters on ShapeTrack, attributes in a
+TrackTable (one float row per track, read through TrackView) and the Kalman
+filters in a KalmanBank per dimensionality, so predict, correct and the
+attribute update run once per frame over all tracks. Detections are matched
+by one gated assignment; unmatched ones become spawn candidates in a
+CandidateGrid until they have been seen spawn_persist times.
+Life cycle: tracks are published once stable_age frames old, coast while
+lost (up to max_lost frames) and step by real capture time when frames are
+timestamped. TrackSnapshot gives other threads a read-only copy, and the
+whole state can be checkpointed to disk for warm restarts.
 """
 
+import json
+import os
 import threading
-from typing import List, Dict, Any, Tuple, Optional, cast
-from dataclasses import dataclass, field
+import time
+import zipfile
+from collections.abc import MutableMapping
+from typing import List, Dict, Any, Callable, Tuple, Optional, Iterator
 import numpy as np
-import cv2
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from config import TRACK_COLOR_GRACE_FRAMES, TRACK_MAX_DT_FRAMES
+
+__all__ = [
+    "ShapeTracker", "MultiClassTracker", "ShapeTrack", "TrackTable", "TrackView", "CandidateGrid",
+    "KalmanBank", "TrackSnapshot", "TrackIdGenerator", "TRACK_IDS", "CheckpointWriter",
+]
 
-__all__ = ["ShapeTracker", "ShapeTrack"]
+TrackClass = Tuple[str, str]   # (shape, color)
 
 # Data structures
 
-@dataclass
+# Fixed track schema. Positions are copied from the last match, measurements
+# are EMA-smoothed (tr_alpha), flags keep their last value.
+POS_KEYS = ("x", "y", "z", "cx", "cy")
+EMA_KEYS = ("r", "w", "h", "angle", "x_mm", "y_mm", "z_mm", "depth_inliers")
+FLAG_KEYS = ("depth_valid", "depth_mask_valid", "color_valid", "shape_valid", "ai_valid", "tracker_valid")
+COLUMNS = POS_KEYS + EMA_KEYS + FLAG_KEYS
+COL = {k: i for i, k in enumerate(COLUMNS)}
+EMA_COLS = slice(len(POS_KEYS), len(POS_KEYS) + len(EMA_KEYS))
+FLAG_START = len(POS_KEYS) + len(EMA_KEYS)
+META_KEYS = ("track_id", "age", "stable_age")
+
+
 class ShapeTrack:
-    data: Dict[str, Any]
-    age: int = 1
-    stable_age: int = 0       # consecutive frames with valid depth mask, etc.
-    lost: int = 0             # consecutive frames unseen
-    id: int = -1
-    vx: float = 0.0
-    vy: float = 0.0
-    vz: float = 0.0
-    kf: Optional[cv2.KalmanFilter] = field(default=None, repr=False)
+    """Life-cycle counters of one track; its attributes live in a TrackTable row."""
+    __slots__ = (
+        "id", "shape", "color", "age", "stable_age", "lost", "color_miss",
+        "vx", "vy", "vz", "bank", "slot", "row", "extra", "stamp",
+    )
 
+    def __init__(self, id: int, shape: str, color: str, row: int, extra: Dict[str, Any],
+                 bank: Optional["KalmanBank"] = None, slot: int = -1, stamp: Optional[float] = None) -> None:
+        self.id = id
+        self.shape = shape
+        self.color = color
+        self.age = 1
+        self.stable_age = 0       # consecutive frames with valid depth mask, etc.
+        self.lost = 0             # consecutive frames unseen
+        self.color_miss = 0       # consecutive frames matched to a detection of another color
+        self.vx = self.vy = self.vz = 0.0
+        self.bank = bank
+        self.slot = slot          # row of this track in bank
+        self.row = row            # row of this track in the TrackTable
+        self.extra = extra        # keys outside the schema; replaced, never mutated
+        self.stamp = stamp        # capture time of the track's last Kalman step
 
-# Utils
 
-class RobustTimeoutError(Exception):
-    """Raised when an external call exceeds permitted duration."""
+def split_detection(det: Dict[str, Any], out: np.ndarray) -> Dict[str, Any]:
+    """Write the schema fields of *det* into the NaN-filled row *out*; return the other keys."""
+    extra = {}
+    for k, v in det.items():
+        c = COL.get(k)
+        if c is None:
+            extra[k] = v
+        elif v is not None:
+            out[c] = float(v)
+    return extra
 
 
-def robust_call(fn, *args, timeout: float = 2.0, retries: int = 2, **kwargs):
-    """Run *fn* with retries + timeout, return its result or raise."""
-    exc: Optional[Exception] = None
+class TrackTable:
+    """
+    Schema attributes of all tracks as one float array, a row per track.
+    NaN marks a key the track has never had.
+    """
+    def __init__(self, capacity: int = 16) -> None:
+        self.values = np.full((capacity, len(COLUMNS)), np.nan)
+        self.free: List[int] = list(range(capacity - 1, -1, -1))
 
-    def wrap(holder):
-        try:
-            holder.append(fn(*args, **kwargs))
-        except Exception as e:
-            holder.append(e)
-
-    for _ in range(retries):
-        holder: List[Any] = []
-        t = threading.Thread(target=wrap, args=(holder,))
-        t.daemon = True
-        t.start()
-        t.join(timeout)
-        if not holder:
-            continue  # timed out
-        if isinstance(holder[0], Exception):
-            exc = holder[0]
+    def add(self, det: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """Row for a new track initialised from *det*; returns (row, extra keys)."""
+        if not self.free:
+            cap = len(self.values)
+            self.values = np.concatenate([self.values, np.full_like(self.values, np.nan)])
+            self.free = list(range(2 * cap - 1, cap - 1, -1))
+        row = self.free.pop()
+        self.values[row] = np.nan
+        return row, split_detection(det, self.values[row])
+
+    def release(self, row: int) -> None:
+        self.free.append(row)
+
+    def clear(self) -> None:
+        self.free = list(range(len(self.values) - 1, -1, -1))
+
+    def update(self, rows: np.ndarray, meas: np.ndarray, alpha: float) -> None:
+        """
+        Fold measurement rows (k, columns; NaN = not measured) into *rows*:
+        copy positions and flags, EMA the measurements, all in one step.
+        """
+        cur = self.values[rows]
+        seen = ~np.isnan(meas)
+        new = np.where(seen, meas, cur)
+        ema = np.nan_to_num(cur[:, EMA_COLS]) * (1 - alpha) + meas[:, EMA_COLS] * alpha
+        new[:, EMA_COLS] = np.where(seen[:, EMA_COLS], ema, cur[:, EMA_COLS])
+        self.values[rows] = new
+
+    def positions(self, rows: np.ndarray) -> np.ndarray:
+        """(k, 3) positions as pos_get() reads them: x/y/z, else cx/cy, else 0."""
+        v = self.values[rows]
+        x = np.where(np.isnan(v[:, COL["x"]]), v[:, COL["cx"]], v[:, COL["x"]])
+        y = np.where(np.isnan(v[:, COL["y"]]), v[:, COL["cy"]], v[:, COL["y"]])
+        return np.nan_to_num(np.column_stack([x, y, v[:, COL["z"]]]))
+
+    def view(self, tr: ShapeTrack) -> "TrackView":
+        """Snapshot of one track as a mapping (e.g. for debugging)."""
+        return TrackView(self.values[tr.row].copy(), tr.extra, (tr.id, tr.age, tr.stable_age))
+
+
+class TrackView(MutableMapping):
+    """
+    Frame output of one track as a mapping. Reads come from a snapshot row of
+    the track table, the track's extra keys and its counters; writes go to a
+    small overlay, so the tracker's state is never touched.
+    """
+    __slots__ = ("_row", "_extra", "_meta", "_over")
+
+    def __init__(self, row: np.ndarray, extra: Dict[str, Any], meta: Tuple[int, int, int]) -> None:
+        self._row = row
+        self._extra = extra
+        self._meta = meta
+        self._over: Optional[Dict[str, Any]] = None
+
+    def __getitem__(self, key: str) -> Any:
+        if self._over is not None and key in self._over:
+            return self._over[key]
+        if key in META_KEYS:
+            return self._meta[META_KEYS.index(key)]
+        c = COL.get(key)
+        if c is None:
+            return self._extra[key]
+        v = self._row[c]
+        if v != v:
+            raise KeyError(key)
+        return bool(v) if c >= FLAG_START else float(v)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if self._over is None:
+            self._over = {}
+        self._over[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if self._over is None or key not in self._over:
+            raise KeyError(key)
+        del self._over[key]
+
+    def __iter__(self) -> Iterator[str]:
+        keys = dict.fromkeys(META_KEYS)
+        keys.update((k, None) for k, v in zip(COLUMNS, self._row) if v == v)
+        keys.update(dict.fromkeys(self._extra))
+        if self._over:
+            keys.update(dict.fromkeys(self._over))
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"TrackView({dict(self)!r})"
+
+
+class KalmanBank:
+    """
+    Constant-velocity Kalman filters for many tracks, stored as stacked arrays
+    (struct of arrays): state x (N, n) and covariance P (N, n, n) with shared
+    F, H, Q, R. Predict and correct run over a set of rows in one batch.
+    Same equations as cv2.KalmanFilter. Time is in frames: F and Q are for
+    one frame, predict() rebuilds them per row for other time steps.
+    """
+    def __init__(self, meas_dim: int, capacity: int = 16) -> None:
+        self.m = meas_dim
+        self.n = 2 * meas_dim                      # position + velocity
+        self.F = np.eye(self.n)
+        self.F[:self.m, self.m:] = np.eye(self.m)  # dt = 1 frame
+        self.Q = np.eye(self.n)
+        self.R = np.eye(self.m)
+        self.noise: Optional[Tuple[float, float]] = None
+        self.x = np.zeros((capacity, self.n))
+        self.P = np.zeros((capacity, self.n, self.n))
+        self.free: List[int] = list(range(capacity - 1, -1, -1))
+
+    def set_noise(self, q: float, r: float) -> None:
+        """Rebuild Q and R only when the slider values changed."""
+        if self.noise != (q, r):
+            self.Q = np.eye(self.n) * q
+            self.R = np.eye(self.m) * r
+            self.noise = (q, r)
+
+    def add(self, pos: List[float]) -> int:
+        """New filter at *pos* with zero velocity and unit covariance; returns its row."""
+        if not self.free:
+            cap = len(self.x)
+            self.x = np.concatenate([self.x, np.zeros_like(self.x)])
+            self.P = np.concatenate([self.P, np.zeros_like(self.P)])
+            self.free = list(range(2 * cap - 1, cap - 1, -1))
+        slot = self.free.pop()
+        self.x[slot] = 0.0
+        self.x[slot, :self.m] = pos
+        self.P[slot] = np.eye(self.n)
+        return slot
+
+    def release(self, slot: int) -> None:
+        self.free.append(slot)
+
+    def clear(self) -> None:
+        self.free = list(range(len(self.x) - 1, -1, -1))
+
+    def predict(self, slots: np.ndarray, dt: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Advance the given rows by *dt* frames each (default one); returns their
+        predicted states (k, n). Process noise grows linearly with dt.
+        """
+        if dt is None:
+            x = self.x[slots] @ self.F.T
+            self.x[slots] = x
+            self.P[slots] = self.F @ self.P[slots] @ self.F.T + self.Q
+            return x
+        dt = np.asarray(dt, dtype=np.float64)
+        F = np.tile(np.eye(self.n), (len(slots), 1, 1))
+        F[:, :self.m, self.m:] = dt[:, None, None] * np.eye(self.m)
+        x = (F @ self.x[slots][:, :, None])[:, :, 0]
+        self.x[slots] = x
+        self.P[slots] = F @ self.P[slots] @ F.transpose(0, 2, 1) + self.Q * dt[:, None, None]
+        return x
+
+    def correct(self, slots: np.ndarray, z: np.ndarray) -> None:
+        """Fold measurements z (k, m) into the given rows."""
+        m = self.m
+        P = self.P[slots]
+        HP = P[:, :m, :]                                   # H = [I 0]
+        S = HP[:, :, :m] + self.R
+        K = np.linalg.solve(S, HP).transpose(0, 2, 1)      # (k, n, m)
+        innov = z - self.x[slots, :m]
+        self.x[slots] += (K @ innov[:, :, None])[:, :, 0]
+        self.P[slots] = P - K @ HP
+
+
+# Spawn candidates
+
+_NEIGHBOURS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+
+
+class CandidateGrid:
+    """
+    Spawn candidates of one class in a spatial hash with cells of the match
+    radius, so a detection only looks at the neighbouring cells.
+    Each candidate is a dict {"det", "seen", "last", "seq"}; seq keeps
+    creation order, which decides ties and the spawn order.
+    """
+    def __init__(self, cell: float) -> None:
+        self.cell = cell
+        self.cells: Dict[Tuple[int, int, int], List[Dict[str, Any]]] = {}
+        self.size = 0
+        self.seq = 0
+
+    def _key(self, det: Dict[str, Any]) -> Tuple[int, int, int]:
+        x, y, z = MultiClassTracker.pos_get(det)
+        c = self.cell
+        return int(x // c), int(y // c), int(z // c)
+
+    def _insert(self, cand: Dict[str, Any]) -> None:
+        self.cells.setdefault(self._key(cand["det"]), []).append(cand)
+        self.size += 1
+
+    def remove(self, cand: Dict[str, Any]) -> None:
+        key = self._key(cand["det"])
+        bucket = self.cells[key]
+        bucket.remove(cand)
+        if not bucket:
+            del self.cells[key]
+        self.size -= 1
+
+    def add(self, det: Dict[str, Any], frame: int) -> None:
+        self._insert({"det": det, "seen": 1, "last": frame, "seq": self.seq})
+        self.seq += 1
+
+    def ordered(self) -> List[Dict[str, Any]]:
+        return sorted((c for bucket in self.cells.values() for c in bucket), key=lambda c: c["seq"])
+
+    def rebuild(self, cell: float) -> None:
+        """Re-bin all candidates for a new match radius."""
+        cands = self.ordered()
+        self.cell, self.cells, self.size = cell, {}, 0
+        for cand in cands:
+            self._insert(cand)
+
+    def first_within(self, det: Dict[str, Any], radius: float) -> Optional[Dict[str, Any]]:
+        """Oldest candidate within *radius* of *det* (radius <= cell size)."""
+        kx, ky, kz = self._key(det)
+        best = None
+        for dx, dy, dz in _NEIGHBOURS:
+            for cand in self.cells.get((kx + dx, ky + dy, kz + dz), ()):
+                if (best is None or cand["seq"] < best["seq"]) and \
+                        MultiClassTracker.det_distance(cand["det"], det) <= radius:
+                    best = cand
+        return best
+
+    def move(self, cand: Dict[str, Any], det: Dict[str, Any]) -> None:
+        """Point *cand* at a new detection, re-binning it if it changed cell."""
+        if self._key(det) != self._key(cand["det"]):
+            self.remove(cand)
+            cand["det"] = det
+            self._insert(cand)
+        else:
+            cand["det"] = det
+
+
+# Matching
+
+def gated_assignment(dist: np.ndarray, gate: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Min-cost (track, detection) pairs using only gated entries of *dist* (m, n).
+    The gated bipartite graph is split into connected components: a component
+    with a single track or a single detection is an argmin, only the rest go
+    through linear_sum_assignment. Same pairs as one solve on the full matrix
+    with ungated entries set to a huge cost.
+    """
+    m, n = gate.shape
+    ti, di = np.nonzero(gate)
+    if ti.size == 0:
+        return []
+    if gate.sum(axis=0).max() == 1 and gate.sum(axis=1).max() == 1:
+        return list(zip(ti.tolist(), di.tolist()))   # every gated pair is its own component
+    graph = coo_matrix((np.ones(ti.size), (ti, m + di)), shape=(m + n, m + n))
+    _, labels = connected_components(graph, directed=False)
+    pairs: List[Tuple[int, int]] = []
+    edge_labels = labels[ti]
+    for comp in np.unique(edge_labels):
+        sel = edge_labels == comp
+        rows, cols = np.unique(ti[sel]), np.unique(di[sel])
+        if rows.size == 1 and cols.size == 1:
+            pairs.append((int(rows[0]), int(cols[0])))
             continue
-        return holder[0]
+        sub = dist[np.ix_(rows, cols)]
+        sub_gate = gate[np.ix_(rows, cols)]
+        if rows.size == 1:
+            pairs.append((int(rows[0]), int(cols[np.argmin(np.where(sub_gate[0], sub[0], np.inf))])))
+        elif cols.size == 1:
+            pairs.append((int(rows[np.argmin(np.where(sub_gate[:, 0], sub[:, 0], np.inf))]), int(cols[0])))
+        else:
+            BIG = 1e6
+            cost = np.where(sub_gate, sub, BIG).astype(np.float32)
+            for r, c in zip(*linear_sum_assignment(cost)):
+                if sub_gate[r, c]:
+                    pairs.append((int(rows[r]), int(cols[c])))
+    pairs.sort()
+    return pairs
 
-    raise RobustTimeoutError(
-        f"Timeout/failure on call {fn.__name__} after {retries} retries: {exc}"
-    )
+
+# Snapshots
+
+class TrackSnapshot:
+    """
+    Read-only copy of the tracker after one frame, for the threads that do not
+    own it: per class the 2D Kalman states and spawn candidates (search
+    windows), the pixel velocities (YOLO motion compensation) and the track
+    and candidate counts (debug stats). Built by the tracking thread with
+    MultiClassTracker.snapshot() and swapped in whole, so readers never see a
+    half-updated tracker.
+    """
+    __slots__ = ("frame_id", "F", "Q", "_classes", "_counts")
+
+    def __init__(self, frame_id: int, F: np.ndarray, Q: np.ndarray,
+                 classes: Dict[TrackClass, Dict[str, Any]], counts: Dict[str, int]) -> None:
+        self.frame_id = frame_id   # frame the snapshot was taken after
+        self.F = F
+        self.Q = Q
+        self._classes = classes
+        self._counts = counts
+
+    def stats(self) -> Dict[str, int]:
+        """Track and spawn-candidate counts, as MultiClassTracker.stats() returned them."""
+        return dict(self._counts)
+
+    def velocity_near(self, shape: str, color: str, cx: float, cy: float, max_dist: float) -> Tuple[float, float]:
+        """Pixel velocity (per frame) of the 2D track closest to (cx, cy), or (0, 0) if none is within *max_dist*."""
+        # 3D tracks are skipped, their velocity is not in pixels
+        entry = self._classes.get((shape, color))
+        if entry is None or not len(entry["pos"]):
+            return 0.0, 0.0
+        pos = entry["pos"]
+        d = np.hypot(pos[:, 0] - cx, pos[:, 1] - cy)
+        # Last closest wins on ties, like a running "<=" minimum
+        i = len(d) - 1 - int(np.argmin(d[::-1]))
+        if d[i] > max_dist:
+            return 0.0, 0.0
+        vx, vy = entry["vel"][i]
+        return float(vx), float(vy)
+
+    def search_windows(
+        self,
+        shape: str,
+        color: str,
+        frame_shape: Tuple[int, ...],
+        steps: int = 1,
+        sigma: float = 3.0,
+        margin: float = 16.0,
+    ) -> Optional[List[Tuple[int, int, int, int]]]:
+        """
+        Boxes (x0, y0, x1, y1) around where each track of (shape, color) will be *steps* frames ahead.
+        Half-size is 1.5 * radius + *sigma* predicted std-devs + *margin*. Spawn candidates
+        get a box of 1.5 * radius + *margin* around their last sighting, so they are seen
+        again before they expire.
+        Returns None when the frame must be scanned fully (a track is lost or not a 2D track).
+        """
+        h, w = frame_shape[:2]
+        entry = self._classes.get((shape, color))
+        if entry is None:
+            return []
+        if not entry["guided"]:
+            return None
+        x, P = entry["x"], entry["P"]
+        for _ in range(max(1, steps)):
+            x = x @ self.F.T
+            P = self.F @ P @ self.F.T + self.Q
+        half = 1.5 * entry["r"] + sigma * np.sqrt(np.maximum(P[:, 0, 0], P[:, 1, 1])) + margin
+        cand = entry["cand"]
+        centres = np.concatenate([x[:, :2], cand[:, :2]])
+        half = np.concatenate([half, 1.5 * cand[:, 2] + margin])
+        rois = []
+        for (px, py), hf in zip(centres, half):
+            x0, y0 = max(0, int(px - hf)), max(0, int(py - hf))
+            x1, y1 = min(w, int(px + hf) + 1), min(h, int(py + hf) + 1)
+            if x0 < x1 and y0 < y1:
+                rois.append((x0, y0, x1, y1))
+        return rois
+
+
+# Checkpoints
+
+CHECKPOINT_VERSION = 1
+
+
+def _plain(d: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-safe copy of *d*: scalars and strings only (masks, contours etc. are dropped)."""
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, np.generic):
+            v = v.item()
+        if v is None or isinstance(v, (str, bool, int, float)):
+            out[k] = v
+    return out
+
+
+def write_checkpoint(path: str, state: Dict[str, np.ndarray]) -> None:
+    """
+    np.savez *state* next to *path* and rename it over *path*, so a crash
+    mid-write leaves the previous checkpoint intact.
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fh:
+        np.savez(fh, **state)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
 
 
+class CheckpointWriter:
+    """
+    Writes checkpoint states (MultiClassTracker.checkpoint_state) to *path* on a
+    background thread, so the tracking thread only pays for the copy. A state
+    still waiting is replaced by a newer one; stop() writes the last one.
+    *on_error* is called with the OSError of a failed write.
+    """
+    def __init__(self, path: str, on_error: Optional[Callable[[OSError], None]] = None):
+        self.path = path
+        self.on_error = on_error
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pending: Optional[Dict[str, np.ndarray]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="checkpoint", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write the state still waiting (on this thread if never started), then end the thread."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        else:
+            self._write_next()
+
+    def submit(self, state: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            self._pending = state
+        self._wake.set()
+
+    def _write_next(self) -> bool:
+        with self._lock:
+            state, self._pending = self._pending, None
+            self._wake.clear()
+        if state is None:
+            return False
+        try:
+            write_checkpoint(self.path, state)
+        except OSError as e:
+            if self.on_error is not None:
+                self.on_error(e)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(0.1)
+            if not self._write_next() and self._stop.is_set():
+                return
+
 
 # Tracker
 
-class ShapeTracker:
-    id_counter: int = 0
+class TrackIdGenerator:
+    """Thread-safe, increasing track IDs. Clearing a tracker does not restart them."""
+
+    def __init__(self, start: int = 1) -> None:
+        self._lock = threading.Lock()
+        self._next = start
+
+    def next(self) -> int:
+        with self._lock:
+            tid = self._next
+            self._next += 1
+            return tid
+
+    def reset(self, start: int = 1) -> None:
+        with self._lock:
+            self._next = start
+
+    def peek(self) -> int:
+        with self._lock:
+            return self._next
+
+    def advance_to(self, start: int) -> None:
+        """Never hand out an ID below *start* (e.g. IDs restored from a checkpoint)."""
+        with self._lock:
+            self._next = max(self._next, start)
+
+
+TRACK_IDS = TrackIdGenerator()
+
+
+class MultiClassTracker:
+    """
+    One tracker for all (shape, color) classes: a single track store, one
+    batched Kalman step and one gated assignment per frame.
+    Shape is a hard constraint. A track may take a detection of another
+    color for up to *color_grace* frames in a row (at a cost of one gate
+    radius), so a briefly misread ball keeps its ID and class.
+    """
 
     # constants for behaviour
     _LOST_BONUS_CAP = 5   # frames – limits how far the radius can inflate
     _MAX_LOST_CLAMP = 60  # frames – global upper bound for slider
 
-    def __init__(self) -> None:
-        self.tracks: Dict[str, List[ShapeTrack]] = {}
-        self.candidates: Dict[str, List[Dict[str, Any]]] = {}
+    def __init__(
+        self,
+        color_grace: int = TRACK_COLOR_GRACE_FRAMES,
+        ids: TrackIdGenerator = TRACK_IDS,
+        frame_period: Optional[float] = None,
+    ) -> None:
+        self.tracks: List[ShapeTrack] = []
+        self.candidates: Dict[TrackClass, CandidateGrid] = {}
+        self.banks: Dict[int, KalmanBank] = {2: KalmanBank(2), 3: KalmanBank(3)}
+        self.table = TrackTable()
+        self.frame = 0   # track_all() calls, clock for candidate lifetime
+        # Seconds per frame for timestamped updates; None → measured from the first intervals
+        self.frame_period = frame_period
+        self._last_stamp: Optional[float] = None
+        self._intervals: List[float] = []
+        self.color_grace = color_grace
+        self.ids = ids
+        # Lower bound for cand_ttl, e.g. the full-rescan interval when detection is tracker-guided
+        self.min_cand_ttl = 0
 
-    @classmethod
-    def next_id(cls) -> int:
-        cls.id_counter += 1
-        return cls.id_counter
+    def next_id(self) -> int:
+        return self.ids.next()
 
     @staticmethod
     def validate_detection(det: Dict[str, Any]) -> None:
@@ -102,74 +623,266 @@ class ShapeTracker:
         return float(x), float(y), float(z)
 
     @staticmethod
-    def track_distance(tr: ShapeTrack, det: Dict[str, Any]) -> float:
-        tx, ty, tz = ShapeTracker.pos_get(tr.data)
-        dx, dy, dz = ShapeTracker.pos_get(det)
+    def det_distance(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+        ax, ay, az = MultiClassTracker.pos_get(a)
+        bx, by, bz = MultiClassTracker.pos_get(b)
+        return float(np.sqrt((ax - bx) ** 2 + (ay - by) ** 2 + (az - bz) ** 2))
+
+    def track_distance(self, tr: ShapeTrack, det: Dict[str, Any]) -> float:
+        tx, ty, tz = self.table.positions(np.array([tr.row]))[0]
+        dx, dy, dz = self.pos_get(det)
         return float(np.sqrt((tx - dx) ** 2 + (ty - dy) ** 2 + (tz - dz) ** 2))
 
-    @staticmethod
-    def init_kf(det: Dict[str, Any], q2d: float, r2d: float, q3d: float, r3d: float) -> cv2.KalmanFilter:
-        """Create a Kalman filter matching the dimensionality of *det*."""
+    def snapshot(self, frame_id: int = 0) -> "TrackSnapshot":
+        """Read-only copy of the per-class state other threads need (see TrackSnapshot)."""
+        bank = self.banks[2]
+        classes: Dict[TrackClass, Dict[str, Any]] = {}
+        for tr in self.tracks:
+            classes.setdefault((tr.shape, tr.color), {"tracks": [], "cands": []})["tracks"].append(tr)
+        for cls, grid in self.candidates.items():
+            classes.setdefault(cls, {"tracks": [], "cands": []})["cands"] = [c["det"] for c in grid.ordered()]
+        for entry in classes.values():
+            tracks = entry.pop("tracks")
+            cands = entry.pop("cands")
+            # Search windows: only when every track is a 2D track seen last frame
+            # and every spawn candidate has a pixel position
+            entry["guided"] = all(tr.lost == 0 and tr.bank is bank for tr in tracks) and \
+                all("cx" in det and "cy" in det for det in cands)
+            entry["cand"] = np.array(
+                [(det["cx"], det["cy"], det.get("r", 0.0)) for det in cands] if entry["guided"] else [],
+                dtype=np.float64,
+            ).reshape(-1, 3)
+            guided = tracks if entry["guided"] else []
+            slots = np.array([tr.slot for tr in guided], dtype=np.int64)
+            entry["x"], entry["P"] = bank.x[slots], bank.P[slots]
+            entry["r"] = np.nan_to_num(self.table.values[[tr.row for tr in guided], COL["r"]])
+            # Pixel velocities: tracks without a 3D position
+            flat = [tr for tr in tracks if np.isnan(self.table.values[tr.row, COL["x"]])]
+            entry["pos"] = self.table.positions(np.array([tr.row for tr in flat], dtype=np.int64))[:, :2]
+            entry["vel"] = np.array([(tr.vx, tr.vy) for tr in flat], dtype=np.float64).reshape(-1, 2)
+            for arr in entry.values():
+                if isinstance(arr, np.ndarray):
+                    arr.flags.writeable = False
+        return TrackSnapshot(frame_id, bank.F.copy(), bank.Q.copy(), classes, self.stats())
+
+    def init_kf(self, det: Dict[str, Any]) -> Tuple[KalmanBank, int]:
+        """Add a filter matching the dimensionality of *det*; returns (bank, slot)."""
         if all(k in det for k in ("x", "y", "z")):
-            kf = cv2.KalmanFilter(6, 3, 0, cv2.CV_32F)
-            dt = 1.0
-            kf.transitionMatrix = np.array([
-                [1, 0, 0, dt, 0, 0],
-                [0, 1, 0, 0, dt, 0],
-                [0, 0, 1, 0, 0, dt],
-                [0, 0, 0, 1, 0, 0],
-                [0, 0, 0, 0, 1, 0],
-                [0, 0, 0, 0, 0, 1],
-            ], np.float32)
-            kf.measurementMatrix = np.eye(3, 6, dtype=np.float32)
-            kf.processNoiseCov = np.eye(6, dtype=np.float32) * q3d
-            kf.measurementNoiseCov = np.eye(3, dtype=np.float32) * r3d
-            kf.errorCovPost = np.eye(6, dtype=np.float32)
-            kf.statePost[:3, 0] = np.array([det["x"], det["y"], det["z"]], dtype=np.float32)
-        else:
-            kf = cv2.KalmanFilter(4, 2, 0, cv2.CV_32F)
-            dt = 1.0
-            kf.transitionMatrix = np.array([
-                [1, 0, dt, 0],
-                [0, 1, 0, dt],
-                [0, 0, 1, 0],
-                [0, 0, 0, 1],
-            ], dtype=np.float32)
-            kf.measurementMatrix = np.eye(2, 4, dtype=np.float32)
-            kf.processNoiseCov = np.eye(4, dtype=np.float32) * q2d
-            kf.measurementNoiseCov = np.eye(2, dtype=np.float32) * r2d
-            kf.errorCovPost = np.eye(4, dtype=np.float32)
-            kf.statePost[:2, 0] = np.array([
-                det.get("cx", det.get("x", 0)),
-                det.get("cy", det.get("y", 0)),
-            ], dtype=np.float32)
-        return kf
+            bank = self.banks[3]
+            return bank, bank.add([det["x"], det["y"], det["z"]])
+        bank = self.banks[2]
+        return bank, bank.add([det.get("cx", det.get("x", 0)), det.get("cy", det.get("y", 0))])
+
+    def observe_stamp(self, timestamp: Optional[float]) -> None:
+        """Learn the frame period as the median of the first ten frame intervals when none is set."""
+        if timestamp is None or self.frame_period is not None:
+            return
+        if self._last_stamp is not None and timestamp > self._last_stamp:
+            self._intervals.append(timestamp - self._last_stamp)
+            if len(self._intervals) >= 10:
+                self.frame_period = float(np.median(self._intervals))
+                self._intervals = []
+        self._last_stamp = timestamp
+
+    def frames_since(self, tracks: List[ShapeTrack], timestamp: Optional[float]) -> Optional[np.ndarray]:
+        """
+        Time since each track's last step in frame periods (clipped to
+        TRACK_MAX_DT_FRAMES), or None to step one frame. Moves the tracks' stamps.
+        """
+        period = self.frame_period
+        if timestamp is None or not period:
+            for tr in tracks:
+                tr.stamp = timestamp
+            return None
+        last = np.array([timestamp - period if tr.stamp is None else tr.stamp for tr in tracks])
+        for tr in tracks:
+            tr.stamp = timestamp
+        return np.clip((timestamp - last) / period, 0.0, TRACK_MAX_DT_FRAMES)
+
+    def stats(self) -> Dict[str, int]:
+        """Track and spawn-candidate counts (candidates bound tracker memory under noisy masks)."""
+        return {
+            "tracks": len(self.tracks),
+            "candidates": sum(grid.size for grid in self.candidates.values()),
+        }
 
     def clear(self) -> None:
+        """Drop all tracks and candidates. IDs keep counting."""
         self.tracks.clear()
         self.candidates.clear()
-        ShapeTracker.id_counter = 0
+        for bank in self.banks.values():
+            bank.clear()
+        self.table.clear()
+
+    def save_checkpoint(self, path: str) -> None:
+        """
+        Write tracks, candidates, Kalman states and the ID counter to *path*
+        (np.savez, see write_checkpoint).
+        """
+        write_checkpoint(path, self.checkpoint_state())
+
+    def checkpoint_state(self) -> Dict[str, np.ndarray]:
+        """
+        Copy of the state save_checkpoint writes, sharing nothing with the
+        tracker, so another thread can write it (CheckpointWriter).
+        """
+        tracks = self.tracks
+        k = len(tracks)
+        kf_dim = np.zeros(k, dtype=np.int64)   # 0 = no filter
+        kf_x = np.zeros((k, 6))
+        kf_P = np.zeros((k, 6, 6))
+        for i, tr in enumerate(tracks):
+            if tr.bank is not None:
+                n = tr.bank.n
+                kf_dim[i] = tr.bank.m
+                kf_x[i, :n] = tr.bank.x[tr.slot]
+                kf_P[i, :n, :n] = tr.bank.P[tr.slot]
+        candidates = [
+            {
+                "cls": list(cls),
+                "cell": grid.cell,
+                "seq": grid.seq,
+                "cands": [
+                    {"det": _plain(c["det"]), "seen": c["seen"], "idle": self.frame - c["last"], "seq": c["seq"]}
+                    for c in grid.ordered()
+                ],
+            }
+            for cls, grid in self.candidates.items()
+        ]
+        noise = [self.banks[m].noise or (np.nan, np.nan) for m in (2, 3)]
+        state = {
+            "version": np.array(CHECKPOINT_VERSION),
+            "saved_at": np.array(time.time()),
+            "next_id": np.array(self.ids.peek()),
+            "frame_period": np.array(np.nan if self.frame_period is None else self.frame_period),
+            "kf_noise": np.array(noise, dtype=np.float64),
+            "columns": np.array(COLUMNS),
+            "track_id": np.array([tr.id for tr in tracks], dtype=np.int64),
+            "track_shape": np.array([tr.shape for tr in tracks], dtype=str),
+            "track_color": np.array([tr.color for tr in tracks], dtype=str),
+            "track_counters": np.array(
+                [(tr.age, tr.stable_age, tr.lost, tr.color_miss) for tr in tracks], dtype=np.int64
+            ).reshape(k, 4),
+            "track_values": self.table.values[[tr.row for tr in tracks]],
+            "track_extra": np.array(json.dumps([_plain(tr.extra) for tr in tracks])),
+            "kf_dim": kf_dim,
+            "kf_x": kf_x,
+            "kf_P": kf_P,
+            "candidates": np.array(json.dumps(candidates)),
+        }
+        return state
+
+    def load_checkpoint(self, path: str, max_age_s: float) -> Optional[float]:
+        """
+        Replace the tracker state with the checkpoint at *path*. The downtime
+        counts as missed frames: Kalman states are coasted over it (capped at
+        TRACK_MAX_DT_FRAMES, like a frame gap) and tracks come back lost, so
+        they are only published again once matched. A checkpoint older than
+        *max_age_s*, from another schema or unreadable is ignored.
+        Returns the checkpoint's age in seconds, or None if nothing was restored.
+        """
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                state = {key: z[key] for key in z.files}
+            age = time.time() - float(state["saved_at"])
+            if int(state["version"]) != CHECKPOINT_VERSION or tuple(state["columns"]) != COLUMNS:
+                return None
+            extras = json.loads(str(state["track_extra"]))
+            candidates = json.loads(str(state["candidates"]))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+        if not 0.0 <= age <= max_age_s:
+            return None
+
+        self.clear()
+        self.ids.advance_to(int(state["next_id"]))
+        if self.frame_period is None and np.isfinite(state["frame_period"]):
+            self.frame_period = float(state["frame_period"])
+        for m, (q, r) in zip((2, 3), state["kf_noise"].tolist()):
+            if q == q:
+                self.banks[m].set_noise(q, r)
+
+        # Tracks; stamps start over because capture clocks restart with the camera
+        for i, tid in enumerate(state["track_id"].tolist()):
+            row, _ = self.table.add({})
+            self.table.values[row] = state["track_values"][i]
+            tr = ShapeTrack(tid, str(state["track_shape"][i]), str(state["track_color"][i]), row, extras[i])
+            tr.age, tr.stable_age, tr.lost, tr.color_miss = state["track_counters"][i].tolist()
+            m = int(state["kf_dim"][i])
+            if m:
+                tr.bank = self.banks[m]
+                tr.slot = tr.bank.add([0.0] * m)
+                tr.bank.x[tr.slot] = state["kf_x"][i, :2 * m]
+                tr.bank.P[tr.slot] = state["kf_P"][i, :2 * m, :2 * m]
+            self.tracks.append(tr)
+
+        # Coast every filter over the downtime, then refresh positions and velocities
+        steps = min(age / self.frame_period, TRACK_MAX_DT_FRAMES) if self.frame_period else 0.0
+        if steps > 0:
+            for tr in self.tracks:
+                tr.lost += max(1, int(round(steps)))
+                tr.stable_age = 0
+        for bank in self.banks.values():
+            members = [tr for tr in self.tracks if tr.bank is bank]
+            if not members:
+                continue
+            slots = np.array([tr.slot for tr in members])
+            x = bank.predict(slots, np.full(len(members), steps)) if steps > 0 else bank.x[slots]
+            rows = np.array([tr.row for tr in members])
+            if bank.m == 3:
+                self.table.values[rows, COL["x"]:COL["z"] + 1] = x[:, :3]
+            else:
+                self.table.values[rows, COL["cx"]:COL["cy"] + 1] = x[:, :2]
+            for tr, v in zip(members, x[:, bank.m:].tolist()):
+                tr.vx, tr.vy = v[0], v[1]
+                tr.vz = v[2] if bank.m == 3 else 0.0
+
+        # Candidates keep their frames-since-seen relative to the frame clock
+        for entry in candidates:
+            grid = CandidateGrid(entry["cell"])
+            for c in entry["cands"]:
+                grid._insert({"det": c["det"], "seen": c["seen"], "last": self.frame - c["idle"], "seq": c["seq"]})
+            grid.seq = entry["seq"]
+            if grid.size:
+                self.candidates[tuple(entry["cls"])] = grid
+        return age
 
     # MAIN TRACKING METHOD
-    def track(
+    def track_all(
         self,
-        shape: str,
-        color: str,
-        detections: List[Dict[str, Any]],
+        detections: Dict[TrackClass, List[Dict[str, Any]]],
         params: Dict[str, Any],
-    ) -> List[Dict[str, Any]]:
-        """Update tracks for (shape, color) and return current visible tracks."""
-        key = f"{shape}_{color}"
+        classes: Optional[List[TrackClass]] = None,
+        timestamp: Optional[float] = None,
+    ) -> Dict[TrackClass, List[Dict[str, Any]]]:
+        """
+        Update tracks for *classes* (default: every class with detections,
+        tracks or candidates) and return the visible tracks per class.
+        With a capture *timestamp* (seconds) the filters step by the real
+        elapsed time, so skipped frames are coasted over; without one each
+        call is one frame.
+        """
+        if classes is None:
+            classes = list(dict.fromkeys(
+                [*detections, *((tr.shape, tr.color) for tr in self.tracks), *self.candidates]
+            ))
+        active = set(classes)
 
         # 1. Validation
-        for det in detections:
-            self.validate_detection(det)
+        dets: List[Dict[str, Any]] = []
+        det_cls: List[TrackClass] = []
+        for cls in classes:
+            for det in detections.get(cls, []):
+                self.validate_detection(det)
+                dets.append(det)
+                det_cls.append(cls)
 
         # 2. Extract runtime parameters
         alpha = float(params.get("tr_alpha", 5)) / 100.0
         base_valid = float(params.get("match_dist", 1500))
         max_lost = int(params.get("max_lost", 30))
         spawn_need = int(params.get("spawn_persist", 3))
+        cand_ttl = max(int(params.get("cand_ttl", 10)), self.min_cand_ttl)
         speed_gain = float(params.get("speed_gain", 0)) / 10.0
         lost_gain = float(params.get("LostGain", 5))
         q2d = float(params.get("kf_q_2d", 2)) / 1000.0
@@ -184,49 +897,51 @@ class ShapeTracker:
         # clamp lost window
         max_lost = max(1, min(max_lost, self._MAX_LOST_CLAMP))
 
-        # 3. Kalman noise matrices
-        tracks: List[ShapeTrack] = self.tracks.get(key, [])
-        for tr in tracks:
-            if tr.kf is None:
+        # 3. Kalman noise (rebuilt only on slider change) and batched predict
+        self.banks[2].set_noise(q2d, r2d)
+        self.banks[3].set_noise(q3d, r3d)
+        tracks = [tr for tr in self.tracks if (tr.shape, tr.color) in active]
+        self.observe_stamp(timestamp)
+        steps = self.frames_since(tracks, timestamp)
+        for bank in self.banks.values():
+            idx = [i for i, tr in enumerate(tracks) if tr.bank is bank]
+            if not idx:
                 continue
-            if tr.kf.statePre.shape[0] == 6:
-                tr.kf.processNoiseCov = np.eye(6, dtype=np.float32) * q3d
-                tr.kf.measurementNoiseCov = np.eye(3, dtype=np.float32) * r3d
+            members = [tracks[i] for i in idx]
+            pred = bank.predict(np.array([tr.slot for tr in members]), None if steps is None else steps[idx])
+            rows = np.array([tr.row for tr in members])
+            if bank.m == 3:
+                self.table.values[rows, COL["x"]:COL["z"] + 1] = pred[:, :3]
             else:
-                tr.kf.processNoiseCov = np.eye(4, dtype=np.float32) * q2d
-                tr.kf.measurementNoiseCov = np.eye(2, dtype=np.float32) * r2d
+                self.table.values[rows, COL["cx"]:COL["cy"] + 1] = pred[:, :2]
+            for tr, p in zip(members, pred[:, bank.m:].tolist()):
+                tr.vx, tr.vy = p[0], p[1]
+                tr.vz = p[2] if bank.m == 3 else 0.0
 
-            pred = robust_call(tr.kf.predict, timeout=1.5)
-            if pred.shape[0] == 6:
-                tr.data.update({"x": float(pred[0]), "y": float(pred[1]), "z": float(pred[2])})
-                tr.vx, tr.vy, tr.vz = map(float, pred[3:6, 0])
-            else:
-                tr.data.update({"cx": float(pred[0]), "cy": float(pred[1])})
-                tr.vx, tr.vy = float(pred[2]), float(pred[3])
-                tr.vz = 0.0
-
-        # 4. Hungarian matching
+        # 4. One gated assignment over all classes
         matched_t, matched_d = set(), set()
-        if tracks and detections and linear_sum_assignment is not None:
-            m, n = len(tracks), len(detections)
-            BIG = 1e6
-            cost = np.full((m, n), BIG, dtype=np.float32)
-            for ti, tr in enumerate(tracks):
-                adapt_th = (
-                    base_valid
-                    + speed_gain * np.linalg.norm([tr.vx, tr.vy, tr.vz])
-                    + lost_gain * min(tr.lost, self._LOST_BONUS_CAP)
-                )
-                for di, det in enumerate(detections):
-                    d = self.track_distance(tr, det)
-                    if d <= adapt_th:
-                        cost[ti, di] = d
-            ti_inds, di_inds = robust_call(linear_sum_assignment, cost, timeout=2.0)
-            for ti, di in zip(ti_inds, di_inds):
-                if cost[ti, di] >= BIG:
-                    continue
+        corrections: Dict[int, List[Tuple[int, List[float]]]] = {2: [], 3: []}
+        if tracks and dets:
+            # Distances and adaptive gates for all pairs at once
+            t_pos = self.table.positions(np.array([tr.row for tr in tracks]))
+            d_pos = np.array([self.pos_get(det) for det in dets])
+            dist = np.sqrt(((t_pos[:, None, :] - d_pos[None, :, :]) ** 2).sum(axis=2))
+            vel = np.array([(tr.vx, tr.vy, tr.vz) for tr in tracks])
+            lost = np.array([min(tr.lost, self._LOST_BONUS_CAP) for tr in tracks])
+            adapt_th = base_valid + speed_gain * np.linalg.norm(vel, axis=1) + lost_gain * lost
+
+            # Class constraints: same shape always, other colors only within the grace window
+            same_shape = np.array([tr.shape for tr in tracks])[:, None] == np.array([c[0] for c in det_cls])[None, :]
+            same_color = np.array([tr.color for tr in tracks])[:, None] == np.array([c[1] for c in det_cls])[None, :]
+            in_grace = np.array([tr.color_miss < self.color_grace for tr in tracks])[:, None]
+            gate = (dist <= adapt_th[:, None]) & same_shape & (same_color | in_grace)
+            cost = np.where(same_color, dist, dist + adapt_th[:, None])
+
+            pairs = gated_assignment(cost, gate)
+            meas_rows = np.full((len(pairs), len(COLUMNS)), np.nan)
+            for (ti, di), meas_row in zip(pairs, meas_rows):
                 tr = tracks[ti]
-                det = detections[di]
+                det = dets[di]
 
                 # Kalman correction
                 meas = []
@@ -237,18 +952,18 @@ class ShapeTracker:
                         meas.append(det["cx"])
                     elif k == "y" and "cy" in det:
                         meas.append(det["cy"])
-                meas = np.array(meas, dtype=np.float32).reshape(-1, 1)
-                if tr.kf is not None and meas.size == tr.kf.measurementMatrix.shape[0]:
-                    _ = robust_call(tr.kf.correct, meas, timeout=1.5)
-
-                # Copy/update data
-                for k, v in det.items():
-                    if k in ("x", "y", "z", "cx", "cy"):
-                        tr.data[k] = v
-                    elif isinstance(v, (int, float)):
-                        tr.data[k] = float(tr.data.get(k, 0)) * (1 - alpha) + v * alpha
-                    else:
-                        tr.data[k] = v
+                if tr.bank is not None and len(meas) == tr.bank.m:
+                    corrections[tr.bank.m].append((tr.slot, meas))
+
+                # Schema fields go to the table below; other keys replace the extra dict on change
+                changed = {}
+                for k, v in split_detection(det, meas_row).items():
+                    if isinstance(v, (int, float)) and not isinstance(v, bool):
+                        v = float(tr.extra.get(k, 0)) * (1 - alpha) + v * alpha
+                    if tr.extra.get(k, changed) is not v:
+                        changed[k] = v
+                if changed:
+                    tr.extra = {**tr.extra, **changed}
 
                 tr.age += 1
                 if det.get("depth_mask_valid", False):
@@ -256,56 +971,91 @@ class ShapeTracker:
                 else:
                     tr.stable_age = 0
                 tr.lost = 0
+                tr.color_miss = 0 if same_color[ti, di] else tr.color_miss + 1
                 matched_t.add(ti)
                 matched_d.add(di)
 
+            # Table update (positions, EMA, flags) and Kalman correction for all matched tracks at once
+            if pairs:
+                self.table.update(np.array([tracks[ti].row for ti, _ in pairs]), meas_rows, alpha)
+            for m, items in corrections.items():
+                if items:
+                    slots, z = zip(*items)
+                    self.banks[m].correct(np.array(slots), np.array(z, dtype=np.float64))
+
         # 5. Update lost counters / reset maturity
         for ti, tr in enumerate(tracks):
             if ti not in matched_t:
-                tr.lost += 1
+                tr.lost += 1 if steps is None else max(1, int(round(steps[ti])))
                 tr.stable_age = 0  # maturity evaporates when object not seen
 
-        # 6. Spawn tracks from candidates
-        cands = self.candidates.get(key, [])
-        new_cands: List[Dict[str, Any]] = []
-        for di, det in enumerate(detections):
-            if di in matched_d or det.get("r", 0) < 25:
-                continue
-            close = False
-            for cand in cands:
-                if self.track_distance(cand["det"], det) <= base_valid:
-                    cand["det"] = det
+        # 6. Spawn tracks from candidates, per class; candidates unseen for cand_ttl frames expire
+        self.frame += 1
+        for cls in classes:
+            grid = self.candidates.get(cls)
+            if grid is None:
+                grid = CandidateGrid(base_valid)
+            elif grid.cell != base_valid:
+                grid.rebuild(base_valid)
+            fresh: List[Dict[str, Any]] = []
+            for di, det in enumerate(dets):
+                if det_cls[di] != cls or di in matched_d or det.get("r", 0) < 25:
+                    continue
+                cand = grid.first_within(det, base_valid)
+                if cand is None:
+                    fresh.append(det)
+                else:
+                    grid.move(cand, det)
                     cand["seen"] += 1
-                    close = True
-                    break
-            if not close:
-                new_cands.append({"det": det, "seen": 1})
-
-        updated_cands = []
-        for cand in cands + new_cands:
-            if cand["seen"] >= spawn_need:
-                tracks.append(
-                    ShapeTrack(
-                        data=dict(cand["det"]),
-                        id=self.next_id(),
-                        kf=self.init_kf(cand["det"], q2d, r2d, q3d, r3d),
-                    )
-                )
+                    cand["last"] = self.frame
+            for det in fresh:
+                grid.add(det, self.frame)
+
+            for cand in grid.ordered():
+                if cand["seen"] >= spawn_need:
+                    grid.remove(cand)
+                    bank, slot = self.init_kf(cand["det"])
+                    row, extra = self.table.add(cand["det"])
+                    self.tracks.append(ShapeTrack(
+                        self.next_id(), cls[0], cls[1], row, extra, bank=bank, slot=slot, stamp=timestamp,
+                    ))
+                elif self.frame - cand["last"] > cand_ttl:
+                    grid.remove(cand)
+            if grid.size:
+                self.candidates[cls] = grid
             else:
-                updated_cands.append(cand)
+                self.candidates.pop(cls, None)
 
         # 7. Prune old tracks
-        self.candidates[key] = updated_cands
-        self.tracks[key] = [tr for tr in tracks if tr.lost <= max_lost]
-
-        # 8. Build output list
-        results: List[Dict[str, Any]] = []
-        for tr in self.tracks[key]:
-            if tr.lost == 0 and tr.stable_age >= min_stable_age:
-                results.append({
-                    **tr.data,
-                    "track_id": tr.id,
-                    "age": tr.age,
-                    "stable_age": tr.stable_age,
-                })
+        for tr in self.tracks:
+            if tr.lost > max_lost:
+                self.table.release(tr.row)
+                if tr.bank is not None:
+                    tr.bank.release(tr.slot)
+        self.tracks = [tr for tr in self.tracks if tr.lost <= max_lost]
+
+        # 8. Build output views over one snapshot of the visible rows
+        results: Dict[TrackClass, List[Dict[str, Any]]] = {cls: [] for cls in classes}
+        visible = [tr for tr in self.tracks
+                   if (tr.shape, tr.color) in active and tr.lost == 0 and tr.stable_age >= min_stable_age]
+        if visible:
+            snap = self.table.values[[tr.row for tr in visible]]
+            for tr, row in zip(visible, snap):
+                results[(tr.shape, tr.color)].append(TrackView(row, tr.extra, (tr.id, tr.age, tr.stable_age)))
         return results
+
+
+class ShapeTracker(MultiClassTracker):
+    """Single-class front end: track() updates one (shape, color) at a time."""
+
+    def track(
+        self,
+        shape: str,
+        color: str,
+        detections: List[Dict[str, Any]],
+        params: Dict[str, Any],
+        timestamp: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """Update tracks for (shape, color) and return current visible tracks."""
+        cls = (shape, color)
+        return self.track_all({cls: detections}, params, classes=[cls], timestamp=timestamp)[cls]
@@ -0,0 +1,104 @@
+"""
+watchdog.py
+
+Frame-level deadline watchdog.
+One long-lived thread watches the deadlines of running stages; the stages
+run their code directly and only check in and out.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from config import STAGE_DEADLINES_MS
+from logging_handler import logger as console_logger
+
+
+class DeadlineWatchdog:
+    """
+    Times stages against per-stage deadlines from a single daemon thread.
+    A stage still running past its deadline is reported while it runs, so a
+    hung call shows up even if it never returns. Every overrun counts as a
+    miss. Python code cannot be preempted, so the watchdog only reports.
+    """
+    def __init__(self, deadlines_ms: Optional[Dict[str, float]] = None) -> None:
+        self.deadlines_ms = dict(STAGE_DEADLINES_MS if deadlines_ms is None else deadlines_ms)
+        self._wake = threading.Condition()
+        self._active: Dict[int, List] = {}   # token → [stage, budget_ms, due, reported]
+        self._next_token = 0
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self.runs: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.worst_ms: Dict[str, float] = {}
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="deadline-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._wake:
+            self._running = False
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    @contextmanager
+    def deadline(self, stage: str, budget_ms: Optional[float] = None) -> Iterator[None]:
+        """
+        Time the enclosed block as *stage*. Without a budget (argument or
+        STAGE_DEADLINES_MS) the block only counts as a run.
+        """
+        budget = self.deadlines_ms.get(stage) if budget_ms is None else budget_ms
+        start = time.perf_counter()
+        token = None
+        if budget is not None:
+            with self._wake:
+                token = self._next_token
+                self._next_token += 1
+                self._active[token] = [stage, budget, start + budget / 1000.0, False]
+                self._wake.notify()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000.0
+            with self._wake:
+                if token is not None:
+                    del self._active[token]
+                self.runs[stage] = self.runs.get(stage, 0) + 1
+                self.worst_ms[stage] = max(self.worst_ms.get(stage, 0.0), elapsed)
+                if budget is not None and elapsed > budget:
+                    self.misses[stage] = self.misses.get(stage, 0) + 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._wake:
+            return {
+                stage: {
+                    "runs": runs,
+                    "misses": self.misses.get(stage, 0),
+                    "worst_ms": round(self.worst_ms.get(stage, 0.0), 2),
+                }
+                for stage, runs in self.runs.items()
+            }
+
+    def _run(self) -> None:
+        with self._wake:
+            while self._running:
+                now = time.perf_counter()
+                next_due = None
+                for entry in self._active.values():
+                    stage, budget, due, reported = entry
+                    if reported:
+                        continue
+                    if due <= now:
+                        entry[3] = True
+                        console_logger.warning(f"[watchdog] '{stage}' still running past its {budget:.0f} ms deadline")
+                    elif next_due is None or due < next_due:
+                        next_due = due
+                # Sleep until the earliest pending deadline or until a stage checks in
+                self._wake.wait(None if next_due is None else next_due - now)
@@ -0,0 +1,102 @@
+"""
+workspace.py
+
+Workspace region of interest: the part of the camera image where objects can appear.
+Rectangles and polygons from config are turned into non-overlapping crop
+rectangles (plus a pixel mask for polygons) that the rest of the pipeline works inside.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from detection import Roi
+
+
+def is_rect(roi: Sequence[Any]) -> bool:
+    return len(roi) == 4 and all(np.isscalar(v) for v in roi)
+
+
+def disjoint_rects(rects: List[Roi]) -> List[Roi]:
+    """
+    Non-overlapping rectangles covering exactly the union of *rects*. The union
+    is cut into bands at every top and bottom edge; touching spans in a band are
+    joined, and so are bands below each other with the same span.
+    """
+    ys = sorted({y for r in rects for y in (r[1], r[3])})
+    out: List[Roi] = []
+    growing: Dict[Tuple[int, int], int] = {}   # x-span → index in out of the rect ending at this band
+    for y0, y1 in zip(ys, ys[1:]):
+        spans: List[List[int]] = []
+        for x0, x1 in sorted((r[0], r[2]) for r in rects if r[1] <= y0 and y1 <= r[3]):
+            if spans and x0 <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], x1)
+            else:
+                spans.append([x0, x1])
+        band: Dict[Tuple[int, int], int] = {}
+        for x0, x1 in spans:
+            i = growing.get((x0, x1))
+            if i is not None:
+                out[i] = (x0, out[i][1], x1, y1)
+            else:
+                i = len(out)
+                out.append((x0, y0, x1, y1))
+            band[(x0, x1)] = i
+        growing = band
+    return out
+
+
+class Workspace:
+    """
+    Crop rectangles covering the configured ROIs of a frame of *frame_shape*.
+    `rects` never overlap and cover no more than the ROIs' bounding boxes;
+    `outside[i]` marks the pixels of `rects[i]` not covered by any ROI (None
+    when the rectangle is fully inside).
+    """
+    def __init__(self, rois: Sequence[Sequence[Any]], frame_shape: Tuple[int, ...]) -> None:
+        h, w = frame_shape[:2]
+        self.frame_shape = tuple(frame_shape[:2])
+        inside = np.zeros((h, w), dtype=np.uint8)
+        rects: List[Roi] = []
+        for roi in rois:
+            if is_rect(roi):
+                x0, y0, x1, y1 = (int(v) for v in roi)
+                x0, y0, x1, y1 = max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+                if x0 < x1 and y0 < y1:
+                    inside[y0:y1, x0:x1] = 255
+                    rects.append((x0, y0, x1, y1))
+            else:
+                poly = np.asarray(roi, dtype=np.int32).reshape(-1, 2)
+                cv2.fillPoly(inside, [poly], 255)
+                x, y, bw, bh = cv2.boundingRect(poly)
+                x0, y0, x1, y1 = max(0, x), max(0, y), min(w, x + bw), min(h, y + bh)
+                if x0 < x1 and y0 < y1:
+                    rects.append((x0, y0, x1, y1))
+
+        self.rects: List[Roi] = disjoint_rects(rects)
+        self.inside = inside
+        self.outside: List[Optional[np.ndarray]] = []
+        for x0, y0, x1, y1 in self.rects:
+            out = inside[y0:y1, x0:x1] == 0
+            self.outside.append(out if out.any() else None)
+
+        if self.rects:
+            xs0, ys0, xs1, ys1 = zip(*self.rects)
+            self.union: Roi = (min(xs0), min(ys0), max(xs1), max(ys1))
+        else:
+            self.union = (0, 0, 0, 0)
+        # Pixel work is what lies inside the ROIs; crops add the polygons' blanked corners
+        self.pixels = int(np.count_nonzero(inside))
+        self.crop_pixels = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in self.rects)
+        self.reduction = 1.0 - self.pixels / float(h * w)
+
+    def contains(self, x: float, y: float) -> bool:
+        xi, yi = int(x), int(y)
+        h, w = self.frame_shape
+        return 0 <= xi < w and 0 <= yi < h and self.inside[yi, xi] > 0
+
+    def summary(self) -> str:
+        h, w = self.frame_shape
+        return (f"Workspace: {self.pixels} of {h * w} px inside ROIs ({self.reduction:.0%} less pixel work), "
+                f"{len(self.rects)} crop(s) of {self.crop_pixels} px")
@@ -3,8 +3,9 @@ yolo_verification.py
 Handles YOLO object detection. Optionally used if ENABLE_YOLO is True.
 Supports both OpenCV DNN (Darknet/ONNX).
 """
+import threading
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
 import cv2
 import numpy as np
@@ -63,9 +64,11 @@ def flat(out) -> List[np.ndarray]:
     return res
 
 
-def run_yolo_inference(frame_bgr, conf_thresh=0.10, iou_thresh=0.80, model_side=416, every_n_frames=2):
+def run_yolo_inference(frame_bgr, conf_thresh=0.10, iou_thresh=0.80, model_side=416, every_n_frames=2,
+                       src_size=None):
     """
     Run YOLO detection on the image and return bounding boxes.
+    If *frame_bgr* is already resized to the model input, pass the original (width, height) as *src_size*.
     """
     global FRAME_COUNTER
     FRAME_COUNTER += 1
@@ -73,7 +76,7 @@ def run_yolo_inference(frame_bgr, conf_thresh=0.10, iou_thresh=0.80, model_side=
         return []
 
     load_model_once()
-    h, w = frame_bgr.shape[:2]
+    w, h = src_size if src_size is not None else frame_bgr.shape[1::-1]
     inp = cv2.resize(frame_bgr, (model_side, model_side))
     blob = cv2.dnn.blobFromImage(inp, 1 / 255.0, (model_side, model_side), swapRB=True, crop=False)
     model_handle.setInput(blob)
@@ -116,6 +119,86 @@ def run_yolo_inference(frame_bgr, conf_thresh=0.10, iou_thresh=0.80, model_side=
     return detections
 
 
+class AsyncYoloWorker:
+    """
+    Runs YOLO on a background thread so frames never wait for the network.
+    Always works on the newest submitted frame and publishes its boxes
+    together with the frame number they were computed on.
+    """
+    def __init__(self, conf_thresh: float = 0.10, iou_thresh: float = 0.80, model_side: int = MODEL_SIDE):
+        self.conf_thresh = conf_thresh
+        self.iou_thresh = iou_thresh
+        self.model_side = model_side
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pending: Optional[Tuple[int, np.ndarray, Tuple[int, int]]] = None
+        self._spare: List[np.ndarray] = []     # model-sized input buffers not in use
+        self._result: Tuple[int, List[Dict[str, object]]] = (-1, [])
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="yolo", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def submit(self, frame_id: int, frame_bgr: np.ndarray) -> None:
+        """
+        Offer a frame to the worker. Replaces any frame still waiting, so only the newest is inferred.
+        The frame is resized into a worker-owned buffer, so the caller may reuse it right away.
+        """
+        with self._lock:
+            buf = self._spare.pop() if self._spare else None
+        buf = cv2.resize(frame_bgr, (self.model_side, self.model_side), dst=buf)
+        with self._lock:
+            if self._pending is not None:
+                self._spare.append(self._pending[1])
+            self._pending = (frame_id, buf, (frame_bgr.shape[1], frame_bgr.shape[0]))
+        self._wake.set()
+
+    def latest(self) -> Tuple[int, List[Dict[str, object]]]:
+        """
+        Return (source frame number, detections) of the newest finished inference.
+        Frame number is -1 until the first result is ready.
+        """
+        if self.error is not None:
+            raise self.error
+        with self._lock:
+            return self._result
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(0.1)
+            with self._lock:
+                item, self._pending = self._pending, None
+                self._wake.clear()
+            if item is None:
+                continue
+            frame_id, frame, size = item
+            try:
+                dets = run_yolo_inference(
+                    frame, conf_thresh=self.conf_thresh, iou_thresh=self.iou_thresh,
+                    model_side=self.model_side, every_n_frames=1, src_size=size,
+                )
+            except Exception as e:
+                log.error(f"YOLO worker stopped: {e}")
+                self.error = e
+                return
+            with self._lock:
+                self._result = (frame_id, dets)
+                self._spare.append(frame)
+
+
 def display_yolo_on_camera_feed(frame_bgr: np.ndarray, detections: List[Dict[str, object]]) -> np.ndarray:
     """
     Draw YOLO detection boxes and labels on the frame.